@@ -37,7 +37,12 @@ not mentioned in the paper are also included here.
 
   -  apply_edit_script(edit_script, s1, s2) - An example function that shows how you could make use of
      the edit script returned by 'diff' or 'shortest_edit_script' by re-constructing s2 from s1 and the
-     edit script.
+     edit script.  It also accepts a list of EditHunk objects.
+
+  -  EditHunk, edit_script_to_hunks(edit_script) and hunks_to_edit_script(hunks) - A more compact format for
+     edit scripts, where each run of inserts, deletes or changes is one object with the operation and the start
+     and length of the run in both sequences, along with functions to convert between the two formats.  An edit
+     script that rewrites a million items needs a million dicts, but only a few hunks.
 
   -  shortest_edit_script(old_sequence, new_sequence) - A well-formatted version of the diff function
      (mentioned above) that optimizes for code clarity and readability.  This version also calls out
@@ -47,6 +52,19 @@ not mentioned in the paper are also included here.
   -  longest_common_subsequence(list1, list2) - A function that returns a list that is the longest
      common sub-sequence of the two input sequences.
 
+  -  diff_iterative(list1, list2, max_cost=None), shortest_edit_script_iterative(old_sequence, new_sequence) and
+     longest_common_subsequence_iterative(old_sequence, new_sequence) - Versions of the above that give
+     exactly the same results, but never copy parts of the sequences or recurse.  They work on index
+     windows into the original sequences, keep the windows that still need to be searched on an
+     explicit stack, and reuse one pair of V arrays for every search.  This avoids the cost of copying
+     the sequences at every level when D is large, and can't hit Python's recursion limit.  diff_iterative
+     also takes an optional cost limit, after which it gives up on finding the minimal edit script and
+     splits the sequences at the furthest point it has reached, similar to GNU diff without --minimal.
+
+  -  find_middle_snake_in_window(old_sequence, old_start, N, new_sequence, new_start, M, Vf, Vb) - The
+     same as find_middle_snake_less_memory, but searches the window old_sequence[old_start:old_start+N],
+     new_sequence[new_start:new_start+M] and uses the V arrays that are passed in.
+
   -  find_middle_snake_less_memory(old_sequence, N, new_sequence, M) - A variant of the 'find middle
      snake' algorithm that has more restriced bounds so the calculation doesn't go off end end of the
      edit grid.  It has worst-case execution time of min(len(a),len(b)) * D, and requires
@@ -56,9 +74,9 @@ not mentioned in the paper are also included here.
      the algorithm discussed in Myers' paper.  This algorithm has worst-case execution time of (M + N) * D
      and requires 2 * (M + N) space.
 
-  -  myers_diff_length_minab_memory(old_sequence, new_sequence) - A version of the basic length measuring 
+  -  myers_diff_length_minab_memory(old_sequence, new_sequence, MAX=None) - A version of the basic length measuring 
      algorithm that makes use of the restriced bounds, and also allocates less memory by treating the V
-     array as a circular buffer.
+     array as a circular buffer.  If MAX is given, it gives up and returns None once D is more than MAX.
 
   -  myers_diff_length_original_page_6(old_sequence, new_sequence) - A concrete implementation of the algorithm
      discussed on page 6 of Myers' paper.
@@ -104,6 +122,70 @@ def diff(e, f, i=0, j=0):
         return [{"operation": "insert", "position_old": i,"position_new":j+n} for n in range(0,M)]
 
 
+#  Returns exactly the same edit script as diff(e, f), but searches index windows of e and f
+#  that are kept on a stack instead of recursing on slices, and reuses one pair of V arrays.
+#  If max_cost is given, any window that needs more than about 2 * max_cost edits is split
+#  without finding its middle snake, so the edit script is still valid but may not be minimal.
+def diff_iterative(e, f, max_cost=None):
+    Z = 2*min(len(e),len(f))+2
+    g,p,zeros = [0]*Z,[0]*Z,[0]*Z
+    rtn,stack = [],[(0,len(e),0,len(f))]
+    while len(stack) > 0:
+        i,I,j,J = stack.pop()
+        N,M = I-i,J-j
+        L,Z = N+M,2*min(N,M)+2
+        if N > 0 and M > 0:
+            w = N-M
+            g[0:Z],p[0:Z] = zeros[0:Z],zeros[0:Z]
+            found = False
+            for h in range(0, (L//2+(L%2!=0))+1):
+                for r in range(0, 2):
+                    c,d,o,m,ei,fj = (g,p,1,1,i,j) if r==0 else (p,g,0,-1,I-1,J-1)
+                    for k in range(-(h-2*max(0,h-M)), h-2*max(0,h-N)+1, 2):
+                        a = c[(k+1)%Z] if (k==-h or k!=h and c[(k-1)%Z]<c[(k+1)%Z]) else c[(k-1)%Z]+1
+                        b = a-k
+                        s,t = a,b
+                        while a<N and b<M and e[ei+m*a]==f[fj+m*b]:
+                            a,b = a+1,b+1
+                        c[k%Z],z=a,-(k-w)
+                        if L%2==o and z>=-(h-o) and z<=h-o and c[k%Z]+d[z%Z] >= N:
+                            D,x,y,u,v = (2*h-1,s,t,a,b) if o==1 else (2*h,N-a,M-b,N-s,M-t)
+                            #  The windows are pushed in reverse order so they come off the stack in order.
+                            if D > 1 or (x != u and y != v):
+                                stack.append((i+u,I,j+v,J))
+                                stack.append((i,i+x,j,j+y))
+                            elif M > N:
+                                stack.append((I,I,j+N,J))
+                            elif M < N:
+                                stack.append((i+M,I,J,J))
+                            found = True
+                            break
+                    if found:
+                        break
+                if found:
+                    break
+                if max_cost is not None and h >= max_cost:
+                    #  Finding the smallest edit script is getting too expensive, so like the TOO_EXPENSIVE heuristic in
+                    #  GNU diff, split the window at the point that either search got furthest to and diff both parts.
+                    best,x,y = 0,0,0
+                    for k in range(-(h-2*max(0,h-M)), h-2*max(0,h-N)+1, 2):
+                        a,b = g[k%Z],g[k%Z]-k
+                        if a+b > best and a+b < L and 0<=a<=N and 0<=b<=M:
+                            best,x,y = a+b,a,b
+                        a,b = p[k%Z],p[k%Z]-k
+                        if a+b > best and a+b < L and 0<=a<=N and 0<=b<=M:
+                            best,x,y = a+b,N-a,M-b
+                    if best > 0:
+                        stack.append((i+x,I,j+y,J))
+                        stack.append((i,i+x,j,j+y))
+                        break
+        elif N > 0:
+            rtn.extend([{"operation": "delete", "position_old": i+n} for n in range(0,N)])
+        else:
+            rtn.extend([{"operation": "insert", "position_old": i,"position_new":j+n} for n in range(0,M)])
+    return rtn
+
+
 
 def find_middle_snake_less_memory(old_sequence, N, new_sequence, M):
     """
@@ -251,6 +333,57 @@ def find_middle_snake_myers_original(old_sequence, N, new_sequence, M):
                 if Vb[k] + Vf[(-(k - Delta))] >= N:
                     return 2 * D, N - x, M - y, N - x_i, M - y_i
 
+def find_middle_snake_in_window(old_sequence, old_start, N, new_sequence, new_start, M, Vf, Vb):
+    """
+    The same as find_middle_snake_less_memory(old_sequence[old_start:old_start+N], N, new_sequence[new_start:new_start+M], M),
+    but without making copies of the sequences.  The V arrays are passed in so that they can be re-used
+    for many searches, and they must have room for at least 2 * min(M,N) + 2 items.  The returned
+    points are relative to the start of the window.
+    """
+    MAX = N + M
+    Delta = N - M
+    
+    V_SIZE=2*min(M,N) + 2
+    #  Start out in the same state as find_middle_snake_less_memory.
+    for i in range(0, V_SIZE):
+        Vf[i] = None
+        Vb[i] = None
+    Vf[1] = 0
+    Vb[1] = 0
+    for D in range(0, (MAX//2+(MAX%2!=0)) + 1):
+        for k in range(-(D - 2*max(0, D-M)), D - 2*max(0, D-N) + 1, 2):
+            if k == -D or k != D and Vf[(k - 1) % V_SIZE] < Vf[(k + 1) % V_SIZE]:
+                x = Vf[(k + 1) % V_SIZE]
+            else:
+                x = Vf[(k - 1) % V_SIZE] + 1
+            y = x - k
+            x_i = x
+            y_i = y
+            while x < N and y < M and old_sequence[old_start + x] == new_sequence[new_start + y]:
+                x = x + 1
+                y = y + 1
+            Vf[k % V_SIZE] = x
+            inverse_k = (-(k - Delta))
+            if (Delta % 2 == 1) and inverse_k >= -(D -1) and inverse_k <= (D -1):
+                if Vf[k % V_SIZE] + Vb[inverse_k % V_SIZE] >= N:
+                    return 2 * D -1, x_i, y_i, x, y
+        for k in range(-(D - 2*max(0, D-M)), (D - 2*max(0, D-N)) + 1, 2):
+            if k == -D or k != D and Vb[(k - 1) % V_SIZE] < Vb[(k + 1) % V_SIZE]:
+                x = Vb[(k + 1) % V_SIZE]
+            else:
+                x = Vb[(k - 1) % V_SIZE] + 1
+            y = x - k
+            x_i = x
+            y_i = y
+            while x < N and y < M and old_sequence[old_start + N - x -1] == new_sequence[new_start + M - y - 1]:
+                x = x + 1
+                y = y + 1
+            Vb[k % V_SIZE] = x
+            inverse_k = (-(k - Delta))
+            if (Delta % 2 == 0) and inverse_k >= -D and inverse_k <= D:
+                if Vb[k % V_SIZE] + Vf[inverse_k % V_SIZE] >= N:
+                    return 2 * D, N - x, M - y, N - x_i, M - y_i
+
 def longest_common_subsequence_h(old_sequence, N, new_sequence, M):
     """
     This function is a concrete implementation of the algorithm for finding the longest common subsequence presented
@@ -345,6 +478,69 @@ def shortest_edit_script(old_sequence, new_sequence):
     #  Just a helper function so you don't have to pass in the length of the sequences.
     return shortest_edit_script_h(old_sequence, new_sequence, 0, 0);
 
+def longest_common_subsequence_iterative(old_sequence, new_sequence):
+    """
+    Returns the same result as longest_common_subsequence(old_sequence, new_sequence), but works on
+    windows into the original sequences that are kept on an explicit stack instead of using recursion.
+
+    Each item on the stack is either a window (old_start, N, new_start, M) that still has to be searched,
+    or a part of old_sequence (old_start, old_end) that is known to be common and can be output directly.
+    """
+    V_SIZE = 2 * min(len(old_sequence), len(new_sequence)) + 2
+    Vf = [None] * V_SIZE
+    Vb = [None] * V_SIZE
+    rtn = []
+    stack = [("window", 0, len(old_sequence), 0, len(new_sequence))]
+    while len(stack) > 0:
+        item = stack.pop()
+        if item[0] == "output":
+            rtn.extend(old_sequence[item[1]:item[2]])
+            continue
+        _, old_start, N, new_start, M = item
+        if N > 0 and M > 0:
+            D, x, y, u, v = find_middle_snake_in_window(old_sequence, old_start, N, new_sequence, new_start, M, Vf, Vb)
+            if D > 1:
+                #  Pushed in reverse order so that they come off the stack in the order they would be output.
+                stack.append(("window", old_start + u, N-u, new_start + v, M-v))
+                stack.append(("output", old_start + x, old_start + u))
+                stack.append(("window", old_start, x, new_start, y))
+            elif M > N:
+                rtn.extend(old_sequence[old_start:old_start + N])
+            else:
+                rtn.extend(new_sequence[new_start:new_start + M])
+    return rtn
+
+def shortest_edit_script_iterative(old_sequence, new_sequence):
+    """
+    Returns the same result as shortest_edit_script_h(old_sequence, len(old_sequence), new_sequence, len(new_sequence), 0, 0),
+    but works on windows (old_start, N, new_start, M) into the original sequences that are kept on an explicit
+    stack instead of using recursion.
+    """
+    V_SIZE = 2 * min(len(old_sequence), len(new_sequence)) + 2
+    Vf = [None] * V_SIZE
+    Vb = [None] * V_SIZE
+    rtn = []
+    stack = [(0, len(old_sequence), 0, len(new_sequence))]
+    while len(stack) > 0:
+        old_start, N, new_start, M = stack.pop()
+        if N > 0 and M > 0:
+            D, x, y, u, v = find_middle_snake_in_window(old_sequence, old_start, N, new_sequence, new_start, M, Vf, Vb)
+            if D > 1 or (x != u and y != v):
+                #  Pushed in reverse order so that the part before the snake is handled first.
+                stack.append((old_start + u, N-u, new_start + v, M-v))
+                stack.append((old_start, x, new_start, y))
+            elif M > N:
+                stack.append((old_start + N, 0, new_start + N, M-N))
+            elif M < N:
+                stack.append((old_start + M, N-M, new_start + M, 0))
+        elif N > 0:
+            for i in range(0, N):
+                rtn.append({"operation": "delete", "position_old": old_start + i})
+        else:
+            for i in range(0, M):
+                rtn.append({"operation": "insert", "position_old": old_start, "position_new": new_start + i})
+    return rtn
+
 
 def get_random_edit_script(old_sequence, new_sequence):
     """
@@ -379,13 +575,15 @@ def get_random_edit_script(old_sequence, new_sequence):
             D = D + 1
     return es
 
-def myers_diff_length_minab_memory(old_sequence, new_sequence):
+def myers_diff_length_minab_memory(old_sequence, new_sequence, MAX=None):
     """
-    A variant that uses min(len(a),len(b)) memory
+    A variant that uses min(len(a),len(b)) memory.  If MAX is given, the search stops once D
+    passes MAX and None is returned, so it takes O((N + M) * MAX) time at most.
     """
     N = len(old_sequence)
     M = len(new_sequence)
-    MAX = N + M
+    if MAX is None or MAX > N + M:
+        MAX = N + M
     
     V_SIZE = 2*min(N,M) + 2
     V = [None] * V_SIZE
@@ -403,6 +601,7 @@ def myers_diff_length_minab_memory(old_sequence, new_sequence):
             V[k % V_SIZE] = x
             if x == N and y == M:
                 return D
+    return None
 
 def myers_diff_length_half_memory(old_sequence, new_sequence):
     """
@@ -758,7 +957,66 @@ def make_random_sequences(size):
         
         return special_cases[case_number][0], special_cases[case_number][1]
 
+class EditHunk(object):
+    #  A run of edits of the same kind.  A delete removes old_length items starting at old_start, an insert
+    #  puts new_length items starting at new_start in front of old_start, and a change replaces old_length
+    #  items starting at old_start with the same number of items starting at new_start.
+    __slots__ = ["operation", "old_start", "old_length", "new_start", "new_length"]
+
+    def __init__(self, operation, old_start, old_length, new_start, new_length):
+        self.operation = operation
+        self.old_start = old_start
+        self.old_length = old_length
+        self.new_start = new_start
+        self.new_length = new_length
+
+def edit_script_to_hunks(edit_script):
+    hunks = []
+    shift = 0  #  The number of inserts minus the number of deletes so far.
+    for e in edit_script:
+        if e["operation"] == "delete":
+            hunk = EditHunk("delete", e["position_old"], 1, e["position_old"] + shift, 0)
+            shift = shift - 1
+        elif e["operation"] == "insert":
+            hunk = EditHunk("insert", e["position_old"], 0, e["position_new"], 1)
+            shift = shift + 1
+        else:
+            hunk = EditHunk("change", e["position_old"], 1, e["position_new"], 1)
+        #  Extend the last hunk if this edit continues it.
+        last = hunks[-1] if len(hunks) > 0 else None
+        if last is not None and last.operation == hunk.operation and last.old_start + last.old_length == hunk.old_start and last.new_start + last.new_length == hunk.new_start:
+            last.old_length = last.old_length + hunk.old_length
+            last.new_length = last.new_length + hunk.new_length
+        else:
+            hunks.append(hunk)
+    return hunks
+
+def hunks_to_edit_script(hunks):
+    edit_script = []
+    for h in hunks:
+        for n in range(0, max(h.old_length, h.new_length)):
+            if h.operation == "delete":
+                edit_script.append({"operation": "delete", "position_old": h.old_start + n})
+            elif h.operation == "insert":
+                edit_script.append({"operation": "insert", "position_old": h.old_start, "position_new": h.new_start + n})
+            else:
+                edit_script.append({"operation": "change", "position_old": h.old_start + n, "position_new": h.new_start + n})
+    return edit_script
+
+def apply_hunks(hunks, s1, s2):
+    #  Copies the unchanged items between hunks, and the new items of each hunk, one slice at a time.
+    new_sequence = []
+    i = 0
+    for h in hunks:
+        new_sequence.extend(s1[i:h.old_start])
+        new_sequence.extend(s2[h.new_start:h.new_start + h.new_length])
+        i = h.old_start + h.old_length
+    new_sequence.extend(s1[i:])
+    return new_sequence
+
 def apply_edit_script(edit_script, s1, s2):
+    if len(edit_script) > 0 and isinstance(edit_script[0], EditHunk):
+        return apply_hunks(edit_script, s1, s2)
     new_sequence = []
     i = 0
     for e in edit_script:
@@ -897,6 +1155,11 @@ def do_test():
     reconstructed_random_sequence_basic = apply_edit_script(random_edit_script, s1, s2)
     reconstructed_random_sequence_simple = apply_edit_script(simplify_edit_script(random_edit_script), s1, s2)
 
+    #  Hunks should give back the same edit script, and the same sequence when applied.
+    minimal_hunks = edit_script_to_hunks(minimal_edit_script)
+    reconstructed_minimal_sequence_hunks = apply_edit_script(minimal_hunks, s1, s2)
+    reconstructed_random_sequence_hunks = apply_edit_script(edit_script_to_hunks(simplify_edit_script(random_edit_script)), s1, s2)
+
     #  Pick out only the deletions
     only_deletes = [item for item in minimal_edit_script if not item["operation"] == "insert"]
     #  If we only apply the deletions to the original sequence, this should
@@ -906,10 +1169,23 @@ def do_test():
     #  Longest common subsequence
     lcs = longest_common_subsequence(s1, s2)
 
+    #  The iterative versions should give exactly the same results as the recursive ones.
+    iterative_edit_script = diff_iterative(s1, s2)
+    recursive_shortest_edit_script = shortest_edit_script_h(s1, len(s1), s2, len(s2), 0, 0)
+    iterative_shortest_edit_script = shortest_edit_script_iterative(s1, s2)
+    iterative_lcs = longest_common_subsequence_iterative(s1, s2)
+
+    #  The edit script with a cost limit should still be valid, just not necessarily minimal.
+    max_cost = random.randint(1, 20)
+    cost_limited_edit_script = diff_iterative(s1, s2, max_cost)
+    reconstructed_cost_limited_sequence = apply_edit_script(cost_limited_edit_script, s1, s2)
+
     #  Edit script length calculations
     optimal_distance = myers_diff_length_original_page_6(s1, s2)
     half_memory_distance = myers_diff_length_half_memory(s1, s2)
     minab_memory_distance = myers_diff_length_minab_memory(s1, s2)
+    max_distance = random.randint(0, 20)
+    bounded_distance = myers_diff_length_minab_memory(s1, s2, max_distance)
     optimize_y_distance = myers_diff_length_optimize_y_variant(s1, s2)
     random_distance = len(random_edit_script)
     edit_script_length = len(minimal_edit_script)
@@ -929,16 +1205,25 @@ def do_test():
         u1 == u2 and
         v1 == v2 and
         reconstructed_lcs_sequence == lcs and
+        iterative_edit_script == minimal_edit_script and
+        iterative_shortest_edit_script == recursive_shortest_edit_script and
+        iterative_lcs == lcs and
+        len(cost_limited_edit_script) >= optimal_distance and
+        compare_sequences(reconstructed_cost_limited_sequence, s2) and
         optimal_distance == edit_script_length and
         optimal_distance == computed_distance and
         optimal_distance == half_memory_distance and
         optimal_distance == minab_memory_distance and
+        bounded_distance == (optimal_distance if optimal_distance <= max_distance else None) and
         optimal_distance == optimize_y_distance and
         random_distance >= optimal_distance and
         compare_sequences(reconstructed_minimal_sequence_basic, s2) and
         compare_sequences(reconstructed_minimal_sequence_simple, s2) and
         compare_sequences(reconstructed_random_sequence_basic, s2) and
-        compare_sequences(reconstructed_random_sequence_simple, s2)
+        compare_sequences(reconstructed_random_sequence_simple, s2) and
+        hunks_to_edit_script(minimal_hunks) == minimal_edit_script and
+        compare_sequences(reconstructed_minimal_sequence_hunks, s2) and
+        compare_sequences(reconstructed_random_sequence_hunks, s2)
     ):
         print("FAILURE!!!!")
         print("Sequences are a=" + str(s1) + " and b=" + str(s2) + "")
@@ -946,6 +1231,7 @@ def do_test():
         print("computed D: " + str(computed_distance))
         print("half memory D: " + str(half_memory_distance))
         print("min A,B memory D: " + str(minab_memory_distance))
+        print("bounded D: " + str(bounded_distance) + " with MAX=" + str(max_distance))
         print("Optimize y D: " + str(optimize_y_distance))
         print("random D: " + str(random_distance))
         print("reconstructed_minimal_sequence_basic: " + str(reconstructed_minimal_sequence_basic))
@@ -953,6 +1239,13 @@ def do_test():
         print("reconstructed_random_sequence_basic: " + str(reconstructed_random_sequence_basic))
         print("reconstructed_random_sequence_simple: " + str(reconstructed_random_sequence_simple))
         print("edit_script_length: " + str(edit_script_length))
+        print("reconstructed_minimal_sequence_hunks: " + str(reconstructed_minimal_sequence_hunks))
+        print("reconstructed_random_sequence_hunks: " + str(reconstructed_random_sequence_hunks))
+        print("iterative_edit_script matches: " + str(iterative_edit_script == minimal_edit_script))
+        print("iterative_shortest_edit_script matches: " + str(iterative_shortest_edit_script == recursive_shortest_edit_script))
+        print("iterative_lcs matches: " + str(iterative_lcs == lcs))
+        print("max_cost: " + str(max_cost) + " cost limited edit script length: " + str(len(cost_limited_edit_script)))
+        print("reconstructed_cost_limited_sequence: " + str(reconstructed_cost_limited_sequence))
         print("Less memory Snake: D=" + str(D1) + " x1=" + str(x1) + " y1=" + str(y1) + " u1=" + str(u1) + " v1=" + str(v1))
         print("Myers original Snake: D=" + str(D2) + " x2=" + str(x2) + " y2=" + str(y2) + " u2=" + str(u2) + " v2=" + str(v2))
         sys.stdout.flush()
@@ -25,6 +25,22 @@ import subprocess
 import signal
 import traceback
 import ctypes
+import bisect
+import re
+import mmap
+import array
+import math
+import collections
+
+try:
+    import numpy  #  Optional, only used to speed up the search on long files.
+except ImportError:
+    numpy = None
+
+try:
+    import concurrent.futures  #  Used by --jobs.  Not part of the standard library on Python 2, where --jobs does nothing.
+except ImportError:
+    concurrent = None
 
 codecs.register(lambda name: codecs.lookup('utf-8') if name == 'cp65001' else None)
 
@@ -33,6 +49,24 @@ TERMINAL_WIDTH_ERROR_EXIT_CODE = 101
 COMMON_PREFIX_ERROR_EXIT_CODE = 102
 FILE_OPEN_FAIL_ERROR_EXIT_CODE = 103
 INVALID_MAX_LINE_LENGTH_ERROR_EXIT_CODE = 104
+INVALID_MAX_COST_ERROR_EXIT_CODE = 105
+INVALID_JOBS_ERROR_EXIT_CODE = 106
+INVALID_MAX_EDITS_ERROR_EXIT_CODE = 107
+FILES_DIFFER_EXIT_CODE = 108  #  Used by --brief.
+INVALID_OUTPUT_BUFFER_SIZE_ERROR_EXIT_CODE = 109
+INVALID_BIT_PARALLEL_WIDTH_ERROR_EXIT_CODE = 110
+
+READ_BLOCK_SIZE = 1024 * 1024  #  Number of bytes (or characters) to read from an input file at a time.
+INTRA_LINE_DIFF_CACHE_BYTES = 16 * 1024 * 1024  #  The highlighted characters of changed line pairs are cached up to about this many bytes.
+DEFAULT_BIT_PARALLEL_WIDTH = 1024  #  Changed lines are diffed with the bit-parallel search if the shorter one is at most this many characters.
+NUMPY_MIN_WINDOW = 256  #  The numpy search is only used when both sides of a window have at least this many lines.
+FAST_MIN_MAX_COST = 256  #  With --fast, the cost limit is the square root of the number of lines, but never less than this.
+PARALLEL_MIN_WINDOW = 512  #  With --jobs, windows with fewer lines than this on either side are not split up any further.
+PARALLEL_TASKS_PER_JOB = 4  #  With --jobs, windows are split up while there are fewer than about this many tasks for each worker process.
+ALIGNED_BLOCK_LINES = 4096  #  With --aligned, lines are first compared in blocks of this many, and only blocks that differ are compared line by line.
+OUTPUT_BUFFER_SIZE = 64 * 1024  #  Output is written out at the end of a row once at least this many bytes are waiting.
+STREAMED_LINES_KEPT = 64  #  When a file is shown as it is read, this many lines before the current one are kept.
+OFFSET_TYPECODE = "q" if sys.version_info >= (3, 3) else "l"  #  Array type for file offsets.  Python 2 has no "q".
 
 UNIX_INSERTION_COLOUR = 42
 UNIX_DELETION_COLOUR = 41
@@ -57,6 +91,7 @@ def make_unix_terminal_interface(rp):
             self.open_sq = e_encode(u"[", rp.output_encoding, "internal")
             self.zero = e_encode(u"0", rp.output_encoding, "internal")
             self.rp = rp
+            self.current_colours = ()  #  The colours the terminal is showing text in.  It starts out with the defaults.
 
             self.terminal_width = None
             try:
@@ -90,13 +125,33 @@ def make_unix_terminal_interface(rp):
             else:
                 raise Exception("Unknown unix colour." + str(c))
 
-        def set_terminal_colours(self, colours):
+        def colour_sequence(self, colours):
             colours_encoded_strings = [as_byte_string(str(self.unix_colour_lookup(k)), self.rp.output_encoding, "internal") for k in colours]
             colours_with_semi = self.semi.join(colours_encoded_strings)
-            output_bytes(self.esc + self.open_sq + colours_with_semi + self.m, self.rp)
+            return self.esc + self.open_sq + colours_with_semi + self.m
+
+        def reset_sequence(self):
+            return self.esc + self.open_sq + self.zero + self.m
+
+        def switch_colours_sequence(self, colours):
+            #  Returns what has to be output to show the text that follows in 'colours', which is
+            #  nothing if the terminal is already using them.
+            if colours == self.current_colours:
+                return b""
+            rtn = self.colour_sequence(colours)
+            if len(self.current_colours) > 0:
+                #  Colours can be foreground or background colours, so the old ones have to be turned off first.
+                rtn = self.reset_sequence() + (rtn if len(colours) > 0 else b"")
+            self.current_colours = colours
+            return rtn
+
+        def set_terminal_colours(self, colours):
+            self.current_colours = tuple(colours)
+            output_bytes(self.colour_sequence(colours), self.rp)
 
         def reset_terminal_colours(self):
-            output_bytes(self.esc + self.open_sq + self.zero + self.m, self.rp)
+            self.current_colours = ()
+            output_bytes(self.reset_sequence(), self.rp)
 
         def as_unicode(self):
             rtn = u""
@@ -205,12 +260,14 @@ def make_windows_terminal_interface(rp):
                         raise Exception("Unknown windows colour." + str(c))
             
                 def set_terminal_colours(self, colours):
+                    self.rp.output_sink.flush()  #  The colours apply to whatever is written from now on.
                     new_colour = self.csbi_wAttributes_original & self.original_colour_mask
                     for c in colours:
                         new_colour = new_colour | self.windows_colour_lookup(c)
                     windll.kernel32.SetConsoleTextAttribute(self.STD_OUTPUT_HANDLE, ctypes.c_ushort(new_colour))
             
                 def reset_terminal_colours(self):
+                    self.rp.output_sink.flush()
                     windll.kernel32.SetConsoleTextAttribute(self.STD_OUTPUT_HANDLE, ctypes.c_ushort(self.csbi_wAttributes_original))
             
                 def as_unicode(self):
@@ -278,6 +335,12 @@ def do_graceful_exit(rp, exit_code):
         except:
             pass
 
+    if rp and hasattr(rp, "output_sink"):
+        try:
+            rp.output_sink.flush()
+        except:
+            pass
+
     if rp and hasattr(rp, "outfile_f") and rp.outfile_f is not None:
         try:
             #  Close the output file
@@ -334,6 +397,588 @@ def diff(e, f, i=0, j=0):
   else:
     return [{"operation": "insert", "position_old": i,"position_new":j+n} for n in range(0,M)]
 
+def push_middle_snake(stack, i, I, j, J, D, x, y, u, v):
+  #  Pushes the parts of window (i, I, j, J) that still need to be searched once its middle snake
+  #  from (x, y) to (u, v) is known.  D is None when the window is just being split at (x, y).
+  N,M = I-i,J-j
+  if D is None or D > 1 or (x != u and y != v):
+    stack.append((i+u,I,j+v,J))
+    stack.append((i,i+x,j,j+y))
+  elif M > N:
+    stack.append((I,I,j+N,J))
+  elif M < N:
+    stack.append((i+M,I,J,J))
+
+def find_middle_snake(e, f, i, I, j, J, max_cost, g, p, max_h=None):
+  #  Searches the window e[i:I], f[j:J], which is not empty on either side, with the V arrays g and p,
+  #  and returns (D, x, y, u, v) for its middle snake, or (None, x, y, x, y) if the window should be
+  #  split at (x, y) because max_cost was reached.  Returns None if max_h is given and the middle snake
+  #  is not found within max_h rounds, which means that D is more than 2 * max_h.
+  N,M = I-i,J-j
+  L,Z,w = N+M,2*min(N,M)+2,N-M
+  g[0:Z],p[0:Z] = [0]*Z,[0]*Z  #  Each window starts with zeroed V arrays, same as diff().
+  for h in range(0, (L//2+(L%2!=0))+1):
+    if max_h is not None and h > max_h:
+      return None
+    for r in range(0, 2):
+      c,d,o,m,ei,fj = (g,p,1,1,i,j) if r==0 else (p,g,0,-1,I-1,J-1)
+      for k in range(-(h-2*max(0,h-M)), h-2*max(0,h-N)+1, 2):
+        a = c[(k+1)%Z] if (k==-h or k!=h and c[(k-1)%Z]<c[(k+1)%Z]) else c[(k-1)%Z]+1
+        b = a-k
+        s,t = a,b
+        while a<N and b<M and e[ei+m*a]==f[fj+m*b]:
+          a,b = a+1,b+1
+        c[k%Z],z=a,-(k-w)
+        if L%2==o and z>=-(h-o) and z<=h-o and c[k%Z]+d[z%Z] >= N:
+          return (2*h-1,s,t,a,b) if o==1 else (2*h,N-a,M-b,N-s,M-t)
+    if max_cost is not None and h >= max_cost:
+      #  Finding the smallest edit script is getting too expensive, so like the TOO_EXPENSIVE heuristic in
+      #  GNU diff, split the window at the point that either search got furthest to and diff both parts.
+      best,x,y = 0,0,0
+      for k in range(-(h-2*max(0,h-M)), h-2*max(0,h-N)+1, 2):
+        a,b = g[k%Z],g[k%Z]-k
+        if a+b > best and a+b < L and 0<=a<=N and 0<=b<=M:
+          best,x,y = a+b,a,b
+        a,b = p[k%Z],p[k%Z]-k
+        if a+b > best and a+b < L and 0<=a<=N and 0<=b<=M:
+          best,x,y = a+b,N-a,M-b
+      if best > 0:
+        return None,x,y,x,y
+
+def window_searcher(e, f, e_lo, e_hi, f_lo, f_hi, max_cost):
+  #  Returns a function that finds the middle snake of a window inside of e[e_lo:e_hi] and f[f_lo:f_hi]
+  #  like find_middle_snake, with one pair of V arrays that is reused for every window.
+  Z = 2*min(e_hi-e_lo,f_hi-f_lo)+2
+  g,p = [0]*Z,[0]*Z
+  #  Line ids can be searched with numpy, which gives exactly the same middle snakes.
+  use_numpy = numpy is not None and e_hi > e_lo and f_hi > f_lo and isinstance(e[e_lo], int) and isinstance(f[f_lo], int)
+  arrays = []  #  e[e_lo:e_hi] and f[f_lo:f_hi] as numpy arrays, made the first time a window is big enough to need them.
+  def search(i, I, j, J, max_h=None):
+    #  max_cost is not used when max_h is given, so that the search either finds the middle snake or gives up.
+    cost = max_cost if max_h is None else None
+    if use_numpy and min(I-i,J-j) >= NUMPY_MIN_WINDOW:
+      if len(arrays) == 0:
+        arrays.extend([numpy.array(e[e_lo:e_hi], dtype=numpy.int64),numpy.array(f[f_lo:f_hi], dtype=numpy.int64)])
+      return find_middle_snake_numpy(arrays[0][i-e_lo:I-e_lo], arrays[1][j-f_lo:J-f_lo], cost, max_h)
+    return find_middle_snake(e, f, i, I, j, J, cost, g, p, max_h)
+  return search
+
+def diff_ranges(e, f, e_lo, e_hi, f_lo, f_hi, max_cost=None, max_edits=None):
+  #  Yields the same edits as diff(e[e_lo:e_hi], f[f_lo:f_hi], e_lo, f_lo) as EditHunk runs, but works
+  #  on index windows into e and f instead of slices, keeps the windows that still need to be searched on
+  #  a stack instead of recursing, and reuses one pair of V arrays.  The leftmost window is always searched
+  #  first, so each hunk is yielded as soon as everything before it is known.  If max_cost
+  #  is given, windows that need more than about 2 * max_cost edits are split without finding
+  #  their middle snake, so the edit script is still valid but may not be minimal.  If max_edits is
+  #  given and the whole window needs more than max_edits inserts and deletes, the search gives up
+  #  once it knows that, and the window is yielded as one delete followed by one insert.
+  search = window_searcher(e, f, e_lo, e_hi, f_lo, f_hi, max_cost)
+  last,stack = None,[(e_lo,e_hi,f_lo,f_hi)]
+  while len(stack) > 0:
+    i,I,j,J = stack.pop()
+    N,M = I-i,J-j
+    if N > 0 and M > 0:
+      if max_edits is not None:
+        #  The middle snake of the whole window is found within (D+1)//2 rounds.
+        snake = search(i, I, j, J, (max_edits+1)//2)
+        if snake is None or snake[0] > max_edits:
+          stack.append((I,I,j,J))
+          stack.append((i,I,j,j))
+          continue
+        max_edits = None  #  The windows that are left are parts of this one, so they need fewer edits.
+        D,x,y,u,v = snake
+      else:
+        D,x,y,u,v = search(i, I, j, J)
+      push_middle_snake(stack, i, I, j, J, D, x, y, u, v)
+    elif N > 0 or M > 0:
+      #  The hunk isn't yielded until the next one is known, in case that one continues it.
+      hunk = EditHunk("delete", i, N, j, 0) if N > 0 else EditHunk("insert", i, 0, j, M)
+      if last is None or not last.extend(hunk):
+        if last is not None:
+          yield last
+        last = hunk
+  if last is not None:
+    yield last
+
+def numpy_snake_length(X, Y, x, y):
+  #  The number of items that are the same from X[x] and Y[y] onwards, compared in blocks of doubling size.
+  n,limit,size = 0,min(len(X)-x,len(Y)-y),64
+  while n < limit:
+    size = min(size, limit-n)
+    different = numpy.flatnonzero(X[x+n:x+n+size] != Y[y+n:y+n+size])
+    if len(different) > 0:
+      return n+int(different[0])
+    n,size = n+size,size*2
+  return limit
+
+def find_middle_snake_numpy(E, F, max_cost, max_h=None):
+  #  Does the same search as find_middle_snake on the window that the numpy arrays E and F hold (usually
+  #  views into arrays of the whole sequences) and returns the same (D, x, y, u, v), (None, x, y, x, y)
+  #  or None.  All of the diagonals of a round are updated at once, which gives the same result since a
+  #  round only reads the values written in the round before.  Snakes are followed with block comparisons.
+  N,M = len(E),len(F)
+  L,Z,w = N+M,2*min(N,M)+2,N-M
+  sides = [(E,F),(E[::-1],F[::-1])]  #  The backward search is a forward search on the reversed window.
+  g,p = numpy.zeros(Z, dtype=numpy.int64),numpy.zeros(Z, dtype=numpy.int64)
+  for h in range(0, (L//2+(L%2!=0))+1):
+    if max_h is not None and h > max_h:
+      return None
+    k = numpy.arange(-(h-2*max(0,h-M)), h-2*max(0,h-N)+1, 2)
+    for r in range(0, 2):
+      c,d,o = (g,p,1) if r==0 else (p,g,0)
+      X,Y = sides[r]
+      above,below = c[(k+1)%Z],c[(k-1)%Z]
+      s = numpy.where((k==-h) | ((k!=h) & (below<above)), above, below+1)
+      t = s-k
+      a = s.copy()
+      inside = numpy.flatnonzero((s<N) & (t<M))
+      for n in inside[X[s[inside]] == Y[t[inside]]]:
+        a[n] += numpy_snake_length(X, Y, int(s[n]), int(t[n]))
+      b = a-k
+      c[k%Z] = a
+      if L%2==o:
+        z = -(k-w)
+        overlaps = numpy.flatnonzero((z>=-(h-o)) & (z<=h-o) & (a+d[z%Z] >= N))
+        if len(overlaps) > 0:
+          n = overlaps[0]
+          a,b,s,t = int(a[n]),int(b[n]),int(s[n]),int(t[n])
+          return (2*h-1,s,t,a,b) if o==1 else (2*h,N-a,M-b,N-s,M-t)
+    if max_cost is not None and h >= max_cost:
+      #  Same choice as in diff_ranges: the first point in (forward, backward) order for each k that got furthest.
+      a = numpy.empty(2*len(k), dtype=numpy.int64)
+      b = numpy.empty(2*len(k), dtype=numpy.int64)
+      a[0::2],b[0::2] = g[k%Z],g[k%Z]-k
+      a[1::2],b[1::2] = p[k%Z],p[k%Z]-k
+      progress = numpy.where((a+b < L) & (a >= 0) & (a <= N) & (b >= 0) & (b <= M), a+b, 0)
+      n = int(numpy.argmax(progress))
+      if progress[n] > 0:
+        x,y = (int(a[n]),int(b[n])) if n%2 == 0 else (N-int(a[n]),M-int(b[n]))
+        return None,x,y,x,y
+
+def common_run_length(e, f, i, j, limit, reverse=False):
+  #  Counts how many items starting at e[i] and f[j] (or ending just before them when
+  #  reverse is set) are the same, up to limit.  Compares slices of doubling size, so long
+  #  common runs are compared mostly with single slice comparisons.
+  n,step = 0,1
+  while step > 0:
+    if n+step <= limit and (e[i+n:i+n+step]==f[j+n:j+n+step] if not reverse else e[i-n-step:i-n]==f[j-n-step:j-n]):
+      n,step = n+step,step*2
+    else:
+      step = step//2
+  return n
+
+def trimmed_window(e, f):
+  #  The window (i, I, j, J) of e and f that is left after stripping the common beginning and end.
+  N,M = len(e),len(f)
+  prefix = common_run_length(e, f, 0, 0, min(N,M))
+  suffix = common_run_length(e, f, N, M, min(N,M)-prefix, True)
+  return prefix,N-suffix,prefix,M-suffix
+
+def diff_length(e, f, i, I, j, J, max_d=None):
+  #  Returns the number of inserts and deletes in the smallest edit script for e[i:I] and f[j:J], or
+  #  None if that is more than max_d.  This is myers_diff_length_minab_memory with a MAX: it only searches
+  #  forward with one V array, so it takes O((N+M) * min(D, max_d)) time and linear space.
+  N,M = I-i,J-j
+  Z = 2*min(N,M)+2
+  V = [0]*Z
+  for D in range(0, min(N+M, N+M if max_d is None else max_d)+1):
+    for k in range(-(D-2*max(0,D-M)), D-2*max(0,D-N)+1, 2):
+      x = V[(k+1)%Z] if (k==-D or k!=D and V[(k-1)%Z]<V[(k+1)%Z]) else V[(k-1)%Z]+1
+      y = x-k
+      while x<N and y<M and e[i+x]==f[j+y]:
+        x,y = x+1,y+1
+      V[k%Z] = x
+      if x >= N and y >= M:
+        return D
+  return None
+
+def diff_trimmed(e, f, max_cost=None, max_edits=None):
+  #  Same as diff(e, f), except that the common beginning and end are stripped first,
+  #  so only the part in the middle gets searched.
+  i,I,j,J = trimmed_window(e, f)
+  for hunk in diff_ranges(e, f, i, I, j, J, max_cost, max_edits):
+    yield hunk
+
+def diff_bit_parallel(e, f, e_lo, e_hi, f_lo, f_hi):
+  #  Returns a minimal edit script for the windows e[e_lo:e_hi] and f[f_lo:f_hi] in the same format
+  #  as diff_ranges, but finds it through the longest common subsequence using the bit-parallel
+  #  algorithm of Allison, Dix and Hyyro.  Python ints are used as bit vectors with one bit per item
+  #  of the shorter window, and one bit vector per item of the longer window is kept for tracing
+  #  back the path, so this is only worth it when the shorter window is not too long.
+  swap = (e_hi-e_lo) > (f_hi-f_lo)
+  a,a_lo,n,b,b_lo,m = (f,f_lo,f_hi-f_lo,e,e_lo,e_hi-e_lo) if swap else (e,e_lo,e_hi-e_lo,f,f_lo,f_hi-f_lo)
+  masks = {}
+  for x in range(0, n):
+    masks[a[a_lo+x]] = masks.get(a[a_lo+x], 0) | (1 << x)
+  all_bits = (1 << n)-1
+  v,rows = all_bits,[all_bits]
+  for y in range(0, m):
+    u = v & masks.get(b[b_lo+y], 0)
+    v = ((v+u) | (v-u)) & all_bits
+    rows.append(v)
+  #  The number of zero bits below bit x in rows[y] is the length of the longest common subsequence
+  #  of a[a_lo:a_lo+x] and b[b_lo:b_lo+y].  Trace back from the end, recording 0 for a match, 1 when
+  #  only a moves forward and 2 when only b moves forward.
+  moves,x,y = [],n,m
+  while x > 0 and y > 0:
+    if (rows[y] >> (x-1)) & 1:
+      moves.append(1)
+      x -= 1
+    elif bin(rows[y-1] & ((1 << x)-1)).count("1") == bin(rows[y] & ((1 << x)-1)).count("1"):
+      moves.append(2)
+      y -= 1
+    else:
+      moves.append(0)
+      x,y = x-1,y-1
+  moves.extend([1]*x + [2]*y)
+  moves.reverse()
+  rtn,i,j = [],e_lo,f_lo
+  for move in moves:
+    if move == 0:
+      i,j = i+1,j+1
+    elif (move == 1) != swap:  #  Only e moved forward.
+      add_hunk(rtn, "delete", i, 1, j, 0)
+      i += 1
+    else:
+      add_hunk(rtn, "insert", i, 0, j, 1)
+      j += 1
+  return rtn
+
+def diff_characters(e, f, max_cost=None, bit_parallel_width=0):
+  #  Used for the diff inside of changed lines.  After trimming the common beginning and end, the
+  #  bit-parallel search is used when the shorter part left is at most bit_parallel_width long.
+  N,M = len(e),len(f)
+  prefix = common_run_length(e, f, 0, 0, min(N,M))
+  suffix = common_run_length(e, f, N, M, min(N,M)-prefix, True)
+  if 0 < min(N,M)-prefix-suffix <= bit_parallel_width:
+    return diff_bit_parallel(e, f, prefix, N-suffix, prefix, M-suffix)
+  return diff_ranges(e, f, prefix, N-suffix, prefix, M-suffix, max_cost)
+
+HISTOGRAM_MAX_CHAIN_LENGTH = 64  #  Lines that appear more often than this are never used as anchors by the histogram diff.
+
+def find_patience_anchors(e, f, i, I, j, J):
+  #  Returns the lines that appear exactly once in both e[i:I] and f[j:J] as (x, x+1, y, y+1)
+  #  regions, keeping the longest set of them that appear in the same order in both.
+  seen = {}  #  line -> [count in e, position in e, count in f, position in f]
+  for x in range(i, I):
+    c = seen.setdefault(e[x], [0, x, 0, None])
+    c[0] += 1
+  for y in range(j, J):
+    c = seen.get(f[y])
+    if c is not None:
+      c[2],c[3] = c[2]+1,y
+  unique = [(seen[f[y]][1], y) for y in range(j, J) if seen.get(f[y]) is not None and seen[f[y]][0] == 1 and seen[f[y]][2] == 1]
+  #  Longest increasing subsequence of the positions in e, by patience sorting.
+  pile_tops,tops_index,previous = [],[],[]
+  for n in range(0, len(unique)):
+    pile = bisect.bisect_left(pile_tops, unique[n][0])
+    if pile == len(pile_tops):
+      pile_tops.append(unique[n][0])
+      tops_index.append(n)
+    else:
+      pile_tops[pile],tops_index[pile] = unique[n][0],n
+    previous.append(tops_index[pile-1] if pile > 0 else None)
+  anchors = []
+  n = tops_index[-1] if len(tops_index) > 0 else None
+  while n is not None:
+    x,y = unique[n]
+    anchors.append((x, x+1, y, y+1))
+    n = previous[n]
+  anchors.reverse()
+  return anchors
+
+def find_histogram_anchor(e, f, i, I, j, J):
+  #  Returns the common region (x0, x1, y0, y1) of e[i:I] and f[j:J] whose least common line
+  #  appears the fewest times in e[i:I], preferring longer regions.  This is the same idea as
+  #  the histogram diff in jgit and git.
+  occurrences = {}
+  for x in range(i, I):
+    occurrences.setdefault(e[x], []).append(x)
+  best,best_count = None,HISTOGRAM_MAX_CHAIN_LENGTH
+  y = j
+  while y < J:
+    positions = occurrences.get(f[y])
+    next_y = y+1
+    if positions is not None and len(positions) <= best_count:
+      for x in positions:
+        x0,x1,y0,y1,count = x,x+1,y,y+1,len(positions)
+        while x0 > i and y0 > j and e[x0-1] == f[y0-1]:
+          x0,y0 = x0-1,y0-1
+          count = min(count, len(occurrences[e[x0]]))
+        while x1 < I and y1 < J and e[x1] == f[y1]:
+          count = min(count, len(occurrences[e[x1]]))
+          x1,y1 = x1+1,y1+1
+        next_y = max(next_y, y1)
+        if best is None or best[1]-best[0] < x1-x0 or count < best_count:
+          best,best_count = (x0,x1,y0,y1),count
+    y = next_y
+  return [] if best is None else [best]
+
+def anchored_windows(e, f, find_anchors):
+  #  Splits e and f at the common lines picked by find_anchors, and yields the windows (i, I, j, J),
+  #  in order, where no anchors can be found.
+  stack = [(0,len(e),0,len(f))]
+  while len(stack) > 0:
+    i,I,j,J = stack.pop()
+    prefix = common_run_length(e, f, i, j, min(I-i,J-j))
+    i,j = i+prefix,j+prefix
+    suffix = common_run_length(e, f, I, J, min(I-i,J-j), True)
+    I,J = I-suffix,J-suffix
+    anchors = find_anchors(e, f, i, I, j, J) if I > i and J > j else []
+    if len(anchors) == 0:
+      yield (i,I,j,J)
+      continue
+    #  Push the windows between the anchors in reverse order so they come off the stack in order.
+    ends = [(I,J)] + [(x0,y0) for (x0,x1,y0,y1) in reversed(anchors)]
+    starts = [(x1,y1) for (x0,x1,y0,y1) in reversed(anchors)] + [(i,j)]
+    for n in range(0, len(ends)):
+      stack.append((starts[n][0],ends[n][0],starts[n][1],ends[n][1]))
+
+def diff_anchored(e, f, find_anchors, max_cost=None, max_edits=None):
+  #  Only runs diff_ranges() in the windows between the anchors picked by find_anchors.  Yields the
+  #  hunks in order, like diff_ranges().
+  for (i,I,j,J) in anchored_windows(e, f, find_anchors):
+    for hunk in diff_ranges(e, f, i, I, j, J, max_cost, max_edits):
+      yield hunk
+
+def join_hunks(hunks):
+  #  Yields the hunks, with the ones that continue each other joined together.
+  last = None
+  for hunk in hunks:
+    if last is None or not last.extend(hunk):
+      if last is not None:
+        yield last
+      last = hunk
+  if last is not None:
+    yield last
+
+worker_sequences = None
+
+def set_worker_sequences(e, f):
+  #  Runs once when each worker process starts, so the sequences are only sent to each worker once
+  #  (or not at all when the worker is forked) instead of with every task.
+  global worker_sequences
+  worker_sequences = (e, f)
+
+def diff_windows_in_worker(windows, max_cost, max_edits, split):
+  #  Returns ("hunks", the hunks of all of the windows, in order).  If split is set, windows is one window that
+  #  is only searched for its middle snake, and ("windows", the parts of it that still need to be searched,
+  #  in order) is returned instead, so that they can be handed out to other workers.
+  e,f = worker_sequences
+  if split:
+    i,I,j,J = windows[0]
+    snake = window_searcher(e, f, i, I, j, J, max_cost)(i, I, j, J, None if max_edits is None else (max_edits+1)//2)
+    if max_edits is not None and (snake is None or snake[0] > max_edits):
+      return "hunks",[EditHunk("delete", i, I-i, j, 0),EditHunk("insert", I, 0, j, J-j)]
+    stack = []
+    D,x,y,u,v = snake
+    push_middle_snake(stack, i, I, j, J, D, x, y, u, v)
+    stack.reverse()
+    return "windows",stack
+  return "hunks",list(join_hunks(hunk for (i,I,j,J) in windows for hunk in diff_ranges(e, f, i, I, j, J, max_cost, max_edits)))
+
+def diff_windows_in_pool(executor, windows, max_cost, max_edits, count):
+  #  Yields the hunks of the windows in order.  Each window that is big enough is handed to a worker to be
+  #  split at its middle snake, and the parts are handed out again as soon as they come back, so the workers
+  #  search the independent parts at the same time.  Once there are count tasks waiting, the windows are
+  #  diffed without splitting them.  The smaller windows are diffed in batches.
+  tasks = []  #  [future, hunks] for each task, in the order of their windows.  hunks is None until it's done.
+  waiting = {}  #  The task for each future that isn't done yet.
+  def submit(windows, max_edits):
+    total = sum([(I-i)+(J-j) for (i,I,j,J) in windows])
+    new,batch,size = [],[],0
+    for (i,I,j,J) in windows:
+      if min(I-i,J-j) >= PARALLEL_MIN_WINDOW and len(waiting)+len(new) < count:
+        if len(batch) > 0:
+          new.append((batch,False))
+          batch,size = [],0
+        new.append(([(i,I,j,J)],True))
+      else:
+        batch.append((i,I,j,J))
+        size += (I-i)+(J-j)
+        if size*count >= total:
+          new.append((batch,False))
+          batch,size = [],0
+    if len(batch) > 0:
+      new.append((batch,False))
+    rtn = []
+    for (task_windows,split) in new:
+      task = [executor.submit(diff_windows_in_worker, task_windows, max_cost, max_edits, split),None]
+      waiting[task[0]] = task
+      rtn.append(task)
+    return rtn
+  tasks = submit(windows, max_edits)
+  while len(tasks) > 0:
+    if tasks[0][1] is not None:
+      for hunk in tasks.pop(0)[1]:
+        yield hunk
+      continue
+    done,not_done = concurrent.futures.wait(list(waiting), return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+      task = waiting.pop(future)
+      kind,result = future.result()
+      if kind == "windows":
+        #  max_edits only applies to the windows that were passed in, not to the parts of them.
+        n = [t is task for t in tasks].index(True)
+        tasks[n:n+1] = submit(result, None)
+      else:
+        task[1] = result
+
+def diff_in_parallel(e, f, windows, max_cost, max_edits, jobs):
+  #  Diffs the windows in a pool of worker processes.  Yields the same hunks as diffing each window with
+  #  diff_ranges() in order, as soon as everything before them is known.
+  windows = list(windows)
+  if len(windows) < 2 and all([min(I-i,J-j) < PARALLEL_MIN_WINDOW for (i,I,j,J) in windows]):  #  Not worth starting any processes.
+    for hunk in join_hunks(hunk for (i,I,j,J) in windows for hunk in diff_ranges(e, f, i, I, j, J, max_cost, max_edits)):
+      yield hunk
+    return
+  with concurrent.futures.ProcessPoolExecutor(jobs, initializer=set_worker_sequences, initargs=(e, f)) as executor:
+    for hunk in join_hunks(diff_windows_in_pool(executor, windows, max_cost, max_edits, jobs*PARALLEL_TASKS_PER_JOB)):
+      yield hunk
+
+def find_confusing_lines(e, f):
+  #  Returns a list with an entry for every line in e that is 1 if the line should be left out of
+  #  the search, and 0 otherwise.  Lines that don't appear in f at all can't be part of any match,
+  #  and lines that appear in f very often are left out if they are surrounded by lines that are
+  #  left out.  This is a port of discard_confusing_lines from GNU diff.
+  counts = {}
+  for line in f:
+    counts[line] = counts.get(line, 0) + 1
+  many,tem = 5,len(e)//64
+  tem = tem >> 2
+  while tem > 0:
+    many,tem = many*2,tem >> 2
+  discards = []
+  for line in e:
+    n = counts.get(line, 0)
+    discards.append(1 if n == 0 else (2 if n > many else 0))  #  2 means only if it's surrounded by discarded lines.
+  end,i = len(e),0
+  while i < end:
+    if discards[i] == 2:
+      discards[i] = 0
+    elif discards[i] != 0:
+      #  Find the end of this run of discardable lines, and count how many are provisional.
+      provisional,j = 0,i
+      while j < end and discards[j] != 0:
+        provisional,j = provisional+(1 if discards[j] == 2 else 0),j+1
+      #  Cancel provisional discards at the end of the run.
+      while j > i and discards[j-1] == 2:
+        discards[j-1],provisional,j = 0,provisional-1,j-1
+      length = j-i
+      if provisional*4 > length:
+        #  Too many of the lines are provisional, so keep them all.
+        for j in range(i, i+length):
+          if discards[j] == 2:
+            discards[j] = 0
+      else:
+        minimum,tem = 1,length >> 2
+        tem = tem >> 2
+        while tem > 0:
+          minimum,tem = minimum << 1,tem >> 2
+        minimum += 1
+        #  Cancel any run of 'minimum' or more provisional lines inside of the larger run.
+        j,consec = 0,0
+        while j < length:
+          if discards[i+j] != 2:
+            consec = 0
+          else:
+            consec += 1
+            if minimum == consec:
+              j -= consec  #  Back up to the start of the provisional lines to cancel all of them.
+            elif minimum < consec:
+              discards[i+j] = 0
+          j += 1
+        #  Cancel provisional lines near both ends of the run, until 3 discarded lines are found
+        #  in a row, or a discarded line is found at least 8 lines in.
+        for (start,step) in [(i,1),(i+length-1,-1)]:
+          consec = 0
+          for j in range(0, length):
+            x = start+step*j
+            if j >= 8 and discards[x] == 1:
+              break
+            if discards[x] == 2:
+              consec,discards[x] = 0,0
+            elif discards[x] == 0:
+              consec = 0
+            else:
+              consec += 1
+            if consec == 3:
+              break
+        i += length-1
+    i += 1
+  return discards
+
+def diff_without_confusing_lines(e, f, diff_function):
+  #  Leaves out the lines picked by find_confusing_lines, runs diff_function on the rest, and
+  #  gives the edit script for the original e and f, where every line that was left out is
+  #  an insert or a delete.
+  e_discards,f_discards = find_confusing_lines(e, f),find_confusing_lines(f, e)
+  e_kept = [x for x in range(0, len(e)) if e_discards[x] == 0]
+  f_kept = [y for y in range(0, len(f)) if f_discards[y] == 0]
+  e_changed,f_changed = [d != 0 for d in e_discards],[d != 0 for d in f_discards]
+  for hunk in diff_function([e[x] for x in e_kept], [f[y] for y in f_kept]):
+    for x in range(hunk.old_start, hunk.old_start+hunk.old_length):
+      e_changed[e_kept[x]] = True
+    for y in range(hunk.new_start, hunk.new_start+hunk.new_length):
+      f_changed[f_kept[y]] = True
+  #  The lines that were not changed in each sequence match up in order.
+  rtn,x,y = [],0,0
+  while x < len(e) or y < len(f):
+    x0,y0 = x,y
+    while x < len(e) and e_changed[x]:
+      x += 1
+    add_hunk(rtn, "delete", x0, x-x0, y, 0)
+    while y < len(f) and f_changed[y]:
+      y += 1
+    add_hunk(rtn, "insert", x, 0, y0, y-y0)
+    x,y = x+1,y+1
+  return rtn
+
+def diff_aligned(e, f):
+  #  Matches up e[x] with f[x] instead of searching for a smallest edit script, so the only edits are changes,
+  #  plus a delete or an insert at the end if one sequence is longer.  e[a:b] is compared to f[a:b] first, which
+  #  takes a single comparison for lists (or FixedWidthFile lines), so only the blocks that differ are compared
+  #  line by line.  Takes linear time and yields the hunks as they are found.
+  n = min(len(e), len(f))
+  run = None  #  Start of the current run of changed lines
+  for b in range(0, n, ALIGNED_BLOCK_LINES):
+    B = min(b+ALIGNED_BLOCK_LINES, n)
+    if e[b:B] == f[b:B]:
+      if run is not None:
+        yield EditHunk("change", run, b-run, run, b-run)
+        run = None
+      continue
+    for x in range(b, B):
+      if e[x] != f[x]:
+        if run is None:
+          run = x
+      elif run is not None:
+        yield EditHunk("change", run, x-run, run, x-run)
+        run = None
+  if run is not None:
+    yield EditHunk("change", run, n-run, run, n-run)
+  if len(e) > n:
+    yield EditHunk("delete", n, len(e)-n, n, 0)
+  if len(f) > n:
+    yield EditHunk("insert", n, 0, n, len(f)-n)
+
+def diff_with_algorithm(e, f, algorithm, max_cost=None, discard_confusing_lines=False, jobs=1, max_edits=None):
+  if discard_confusing_lines:
+    return diff_without_confusing_lines(e, f, lambda a, b: diff_with_algorithm(a, b, algorithm, max_cost, False, jobs, max_edits))
+  if jobs > 1 and concurrent is not None:
+    if algorithm == "patience":
+      windows = anchored_windows(e, f, find_patience_anchors)
+    elif algorithm == "histogram":
+      windows = anchored_windows(e, f, find_histogram_anchor)
+    else:
+      windows = [trimmed_window(e, f)]
+    return diff_in_parallel(e, f, windows, max_cost, max_edits, jobs)
+  if algorithm == "patience":
+    return diff_anchored(e, f, find_patience_anchors, max_cost, max_edits)
+  elif algorithm == "histogram":
+    return diff_anchored(e, f, find_histogram_anchor, max_cost, max_edits)
+  else:
+    return diff_trimmed(e, f, max_cost, max_edits)
 
 err_source = None
 err_counts = None
@@ -379,6 +1024,9 @@ def e_decode(s, enc, err):
 
 codecs.register_error("ignore", ignore_errors)
 
+def get_error_counts():
+    return dict([(k, err_counts[k]["count"]) for k in err_counts])
+
 def group_unicode_characters(s):
     #  This function groups together unicode 'characters' that are
     #  really one unicode 'character'.  This is done specifically to
@@ -484,70 +1132,103 @@ def evaluate_escape_sequences(s, enc, err):
     bytes_as_ints = string_as_int_array(double_escaped_unicode, enc, err)
     return e_decode(de_double_slashes(bytes_as_ints), "unicode-escape", err)
 
-def get_parts_for_change_region(edit_script, i, ins, dels):
-    parts = []
+class EditHunk(object):
+    #  A run of edits of the same kind.  A delete removes old_length items starting at old_start, an insert
+    #  puts new_length items starting at new_start in front of old_start, and a change replaces old_length
+    #  items starting at old_start with the same number of items starting at new_start.
+    __slots__ = ["operation", "old_start", "old_length", "new_start", "new_length"]
+
+    def __init__(self, operation, old_start, old_length, new_start, new_length):
+        self.operation = operation
+        self.old_start = old_start
+        self.old_length = old_length
+        self.new_start = new_start
+        self.new_length = new_length
+
+    def length(self):
+        #  The number of single item edits in this hunk.
+        return max(self.old_length, self.new_length)
+
+    def position_old(self, n):
+        #  The 'position_old' of edit n in the one dict per edit format.
+        return self.old_start if self.operation == "insert" else self.old_start + n
+
+    def extend(self, hunk):
+        #  Adds hunk onto the end of this one if it continues it, and returns whether it did.
+        if self.operation == hunk.operation and self.old_start + self.old_length == hunk.old_start and self.new_start + self.new_length == hunk.new_start:
+            self.old_length += hunk.old_length
+            self.new_length += hunk.new_length
+            return True
+        return False
+
+def add_hunk(hunks, operation, old_start, old_length, new_start, new_length):
+    #  Appends a run of edits to hunks, extending the last hunk if the run continues it.
+    if old_length == 0 and new_length == 0:
+        return
+    hunk = EditHunk(operation, old_start, old_length, new_start, new_length)
+    if len(hunks) == 0 or not hunks[-1].extend(hunk):
+        hunks.append(hunk)
+
+def hunks_to_edit_script(hunks):
+    #  Expands hunks into the older edit script format with one dict per inserted, deleted or changed item.
+    edit_script = []
+    for h in hunks:
+        for n in range(0, h.length()):
+            if h.operation == "delete":
+                edit_script.append({"operation": "delete", "position_old": h.old_start + n})
+            elif h.operation == "insert":
+                edit_script.append({"operation": "insert", "position_old": h.old_start, "position_new": h.new_start + n})
+            else:
+                edit_script.append({"operation": "change", "position_old": h.old_start + n, "position_new": h.new_start + n})
+    return edit_script
+
+def get_parts_for_change_region(old_start, new_start, inserted, deleted):
     #  This is the size of the 'changed' region.
-    square_size = min(len(ins), len(dels))
+    square_size = min(inserted, deleted)
     #  These are the inserts and deletes that have been paired up
-    for n in range(0, square_size):
-        parts.append({"operation": "change", "position_old": edit_script[dels[n]]["position_old"] ,"position_new": edit_script[ins[n]]["position_new"]})
+    parts = [EditHunk("change", old_start, square_size, new_start, square_size)]
     #  These are the leftover inserts, that must be pushed 'square_size' units to the right.
-    for n in range(square_size, len(ins)):
-        m = edit_script[ins[n]]
-        #  Adjust the insertion positions so the offsets make sense in the simplified path.
-        shift_right = square_size - (m["position_old"] - edit_script[i]["position_old"])
-        p = {"operation": "insert", "position_old": m["position_old"] + shift_right, "position_new": m["position_new"]}
-        parts.append(p)
-
+    if inserted > square_size:
+        parts.append(EditHunk("insert", old_start + square_size, 0, new_start + square_size, inserted - square_size))
     #  These are the leftover deletes.
-    for n in range(square_size, len(dels)):
-        m = edit_script[dels[n]]
-        parts.append(m)
-
+    if deleted > square_size:
+        parts.append(EditHunk("delete", old_start + square_size, deleted - square_size, new_start + square_size, 0))
     return parts
 
 
+def simplify_path(path):
+    #  Pairs up the inserts and deletes in a contiguous path of them as changes.
+    inserted = sum([hunk.new_length for hunk in path])
+    deleted = sum([hunk.old_length for hunk in path])
+    if inserted > 0 and deleted > 0:
+        new_start = [hunk.new_start for hunk in path if hunk.operation == "insert"][0]
+        return get_parts_for_change_region(path[0].old_start, new_start, inserted, deleted)
+    #  A lone sequence of deletes or inserts
+    parts = []
+    for hunk in path:
+        add_hunk(parts, hunk.operation, hunk.old_start, hunk.old_length, hunk.new_start, hunk.new_length)
+    return parts
+
 def simplify_edit_script(edit_script):
     #  If we find a contiguous path composed of inserts and deletes, make them into 'changes' so they
-    #  can produce more visually pleasing diffs.
-    new_edit_script = []
-    m = len(edit_script)
-    i = 0
-    while i < m:
-        others = []
-        ins = []
-        dels = []
-        last_indx = edit_script[i]["position_old"]
+    #  can produce more visually pleasing diffs.  Takes any iterable of EditHunk objects, and yields the
+    #  simplified hunks as soon as each path ends, so the diff can still be in progress.
+    path = []
+    last_indx = None
+    for hunk in edit_script:
         #  Follow the path of inserts and deletes
-        while i + len(ins) + len(dels) < m:
-            indx = i + len(ins) + len(dels)
-            edit = edit_script[indx]
-            if edit["operation"] == "insert" and edit["position_old"] == last_indx:
-                last_indx = edit["position_old"]
-                ins.append(indx)
-            elif edit["operation"] == "delete" and edit["position_old"] == last_indx:
-                last_indx = edit["position_old"] + 1
-                dels.append(indx)
-            else:
-                if edit["operation"] == "insert" or edit["operation"] == "delete":
-                    pass #  Non-contiguous insert or delete.
-                else:  #  The current edit is something other than delete or insert, just add it...
-                    others.append(indx)
-                break
-        if len(ins) > 0 and len(dels) > 0:
-            #  Do simplify
-            new_edit_script.extend(get_parts_for_change_region(edit_script, i, ins, dels))
+        if not (len(path) > 0 and hunk.operation != "change" and hunk.old_start == last_indx):
+            for part in simplify_path(path):
+                yield part
+            path = []
+        if hunk.operation == "change":
+            #  The current edit is something other than delete or insert, just add it...
+            yield hunk
         else:
-            #  Add the lone sequence of deletes or inserts
-            for r in range(0, len(dels)):
-                new_edit_script.append(edit_script[dels[r]])
-            for r in range(0, len(ins)):
-                new_edit_script.append(edit_script[ins[r]])
-        for r in range(0, len(others)):
-            new_edit_script.append(edit_script[others[r]])
-        i += len(ins) + len(dels) + len(others)
-    return new_edit_script
-
+            path.append(hunk)
+            last_indx = hunk.old_start + hunk.old_length
+    for part in simplify_path(path):
+        yield part
 
 def is_probably_on_windows():
     p = platform.system().lower()
@@ -557,27 +1238,472 @@ def is_probably_on_windows():
         return True
     return False
 
-def read_char(in_fileobj, file_encoding, rp, file_source, as_binary):
-    c = None
-    try:
-        c = in_fileobj.read(1)
-    except UnicodeError as e:
-        src = e_decode(as_byte_string(file_source, rp.output_encoding, "internal"), rp.output_encoding, "internal")
-        msg = e_decode(as_byte_string(str(e), rp.output_encoding, "internal"), rp.output_encoding, "internal")
-        output_bytes(e_encode(u"Fatal unicode error from " + src + u": " + msg + rp.output_newline, rp.output_encoding, "internal"), rp)
-        do_graceful_exit(rp, MISSING_BYTE_ORDER_MARKER_EXIT_CODE)
+def do_file_read_unicode_error(e, rp, file_source):
+    src = e_decode(as_byte_string(file_source, rp.output_encoding, "internal"), rp.output_encoding, "internal")
+    msg = e_decode(as_byte_string(str(e), rp.output_encoding, "internal"), rp.output_encoding, "internal")
+    output_bytes(e_encode(u"Fatal unicode error from " + src + u": " + msg + rp.output_newline, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, MISSING_BYTE_ORDER_MARKER_EXIT_CODE)
+
+class CharacterConverter(object):
+    #  Converts each character read from an input file into the bytes that will
+    #  make up the lines of the diff.  Every distinct character is only converted
+    #  once, but the encoding errors it caused are counted every time it is seen.
+    def __init__(self, file_encoding, rp, file_source, as_binary):
+        self.file_encoding = file_encoding
+        self.rp = rp
+        self.file_source = file_source
+        self.as_binary = as_binary
+        self.cache = {}
+        self.standalone = {}
+
+    def is_standalone(self, c):
+        #  Some encodings (like big5hkscs) decode one byte sequence into several code
+        #  points that can't be encoded again by themselves.  Those were returned
+        #  together by a single read, so keep them attached to the previous character.
+        r = self.standalone.get(c)
+        if r is None:
+            try:
+                codecs.encode(c, self.file_encoding, "strict")
+                r = True
+            except UnicodeError:
+                r = False
+            self.standalone[c] = r
+        return r
+
+    def characters(self, block):
+        if self.as_binary:
+            return bytearray(block)
+        chars = []
+        for c in block:
+            if len(chars) > 0 and not self.is_standalone(c):
+                chars[-1] += c
+            else:
+                chars.append(c)
+        return chars
+
+    def convert(self, c):
+        global err_counts
+        r = self.cache.get(c)
+        if r is None:
+            errors_before = err_counts[self.file_source]["count"]
+            if self.as_binary:
+                b = int_array_as_byte_string([c])
+            else:
+                #  Get the bytes instead of characters
+                b = e_encode(c, self.file_encoding, self.file_source)
+            if not self.rp.pretty_output:  #  Try to convert it to the output format right away
+                b = e_encode(e_decode(b, self.file_encoding, self.file_source), self.rp.output_encoding, self.file_source)
+            r = (b, err_counts[self.file_source]["count"] - errors_before)
+            self.cache[c] = r
+        else:
+            err_counts[self.file_source]["count"] += r[1]
+        return r[0]
 
-    if as_binary:
-        more_chars = c != b""
-    else:
-        more_chars = c != u""
-        #  Get the bytes instead of characters
-        c = e_encode(c, file_encoding, file_source)
+def read_file_blocks(in_fileobj, converter, rp, file_source, as_binary):
+    #  Yields the contents of the file as (data, char_ends) pairs.  'char_ends' is None
+    #  when every byte of 'data' is a character by itself, otherwise it lists the offset
+    #  into 'data' where each character ends (characters can be zero bytes long).
+    while True:
+        block = None
+        try:
+            block = in_fileobj.read(READ_BLOCK_SIZE)
+        except UnicodeError as e:
+            do_file_read_unicode_error(e, rp, file_source)
+
+        if len(block) == 0:
+            #  Note u"".encode("utf-16") == b"\xff\xfe", so be careful on loop termination.
+            return
+
+        if as_binary and rp.pretty_output:
+            yield block, None
+        else:
+            parts = [converter.convert(c) for c in converter.characters(block)]
+            char_ends = []
+            end = 0
+            for p in parts:
+                end += len(p)
+                char_ends.append(end)
+            yield b"".join(parts), char_ends
+
+class DelimiterMatcher(object):
+    #  All of the delimiters compiled into one regular expression so that the
+    #  input can be searched for every delimiter in a single pass.
+    def __init__(self, delimiters):
+        self.delimiters = [d["delimiter"] for d in delimiters]
+        self.level_adjusts = [d["level_adjust"] for d in delimiters]
+        self.longest_delimiter = max([len(d) for d in self.delimiters]) if len(self.delimiters) > 0 else 0
+        self.pattern = None
+        if len(self.delimiters) > 0:
+            self.pattern = re.compile(b"|".join([b"(" + re.escape(d) + b")" for d in self.delimiters]))
+        #  Since no delimiter is a prefix of another one (see validate_delimiters), at most one
+        #  delimiter can match at any position.  The leftmost match is then also the one that
+        #  ends first, unless a delimiter can appear inside of another delimiter.
+        self.has_nested_delimiters = False
+        for i in range(0, len(self.delimiters)):
+            for j in range(0, len(self.delimiters)):
+                if i != j and self.delimiters[i].find(self.delimiters[j]) != -1:
+                    self.has_nested_delimiters = True
+
+    def search(self, buf, pos):
+        #  Returns (start, end, delimiter index) for the delimiter in buf[pos:] that ends first.
+        m = self.pattern.search(buf, pos)
+        if m is None:
+            return None
+        start, end, k = m.start(), m.end(), m.lastindex - 1
+        if self.has_nested_delimiters:
+            #  Anything that ends earlier must be inside of the current match.
+            while end - start > 1:
+                m = self.pattern.search(buf, start + 1, end)
+                if m is None:
+                    break
+                start, end, k = m.start(), m.end(), m.lastindex - 1
+        return start, end, k
+
+    def find_first_in_order(self, buf, start, end):
+        #  Same as checking each delimiter in order against buf[start:end].
+        for k in range(0, len(self.delimiters)):
+            position = buf.find(self.delimiters[k], start, end)
+            if position != -1:
+                return position, k
+        return None
+
+class LineSplitter(object):
+    #  Splits a stream of characters into lines using the delimiters and the max
+    #  line length from the run parameters.  The stream is processed in blocks, and
+    #  the result is the same as appending one character at a time to the current
+    #  line and checking for delimiters and line cuts after each character.
+    def __init__(self, rp):
+        self.rp = rp
+        self.matcher = rp.delimiter_matcher
+        #  The next delimiter in the stream as (start, end, delimiter index), and the position
+        #  to resume searching from when there is no delimiter in what has been read so far.
+        self.next_match = None
+        self.resume_search = 0
+        self.buf = bytearray()
+        self.base = 0  #  Stream offset of the first byte in 'buf'
+        self.line_start = 0  #  Stream offset where the current line begins
+        self.current_level = 0
+        self.current_byte_offset = 0
+        self.chars_since_cut = 0
+        self.rtn = []
+        self.byte_offsets = []
+        self.indentation_levels = []
+
+    def add_line(self, start, end, level):
+        self.rtn.append(bytes(self.buf[start - self.base:end - self.base]))
+        self.indentation_levels.append(level)
+        self.byte_offsets.append(self.current_byte_offset)
+        self.current_byte_offset += end - start
+
+    def add_lines(self, start, length, count, level):
+        #  Same as calling add_line for 'count' lines that are each 'length' bytes long.
+        offset = start - self.base
+        data = bytes(self.buf[offset:offset + count * length])
+        self.rtn.extend([data[k:k + length] for k in range(0, count * length, length)])
+        self.indentation_levels.extend([level] * count)
+        self.byte_offsets.extend(range(self.current_byte_offset, self.current_byte_offset + count * length, length))
+        self.current_byte_offset += count * length
+
+    def next_delimiter(self):
+        #  Returns the (start, end, delimiter index) of the delimiter that ends first in the current line.
+        if self.next_match is None or self.next_match[0] < self.line_start:
+            search_from = max(self.line_start, self.resume_search)
+            m = self.matcher.search(self.buf, search_from - self.base)
+            if m is None:
+                self.next_match = None
+                #  Anything starting before this point would have been found.
+                self.resume_search = max(search_from, self.base + len(self.buf) - self.matcher.longest_delimiter + 1)
+            else:
+                self.next_match = (m[0] + self.base, m[1] + self.base, m[2])
+        return self.next_match
+
+    def split_at_delimiter(self, end, match):
+        position, k = match[0], match[2]
+        if end != match[1] or self.matcher.has_nested_delimiters:
+            #  More than one delimiter could have been completed, so pick the first one in the list.
+            position, k = self.matcher.find_first_in_order(self.buf, self.line_start - self.base, end - self.base)
+            position += self.base
+        if position > self.line_start:  #  Avoid adding empty lines
+            self.add_line(self.line_start, position, self.current_level)
+        level_before = self.current_level
+        self.current_level += self.matcher.level_adjusts[k]
+        if self.current_level < 0:
+            self.current_level = 0
+        if self.rp.include_delimiters:
+            self.add_line(position, end, min(self.current_level, level_before))  #  Only if you want to include delimiters.
+        self.line_start = end
+
+    def feed(self, data, char_ends):
+        block_base = self.base + len(self.buf)
+        self.buf += data
+        num_chars = len(data) if char_ends is None else len(char_ends)
+
+        if self.matcher.pattern is None and char_ends is None and self.rp.cut_lines:
+            #  Every line is just the next max_line_length bytes (as in hex mode), so they can be sliced out directly.
+            length = self.rp.max_line_length
+            count = (block_base + num_chars - self.line_start) // length
+            if count > 0:
+                self.add_lines(self.line_start, length, count, self.current_level)
+                self.line_start += count * length
+            self.chars_since_cut = block_base + num_chars - self.line_start
+            del self.buf[0:self.line_start - self.base]
+            self.base = self.line_start
+            return
+
+        def char_end(n):
+            return block_base + n + 1 if char_ends is None else block_base + char_ends[n]
+
+        i = 0  #  Next character in this block that has not been processed
+        while i < num_chars:
+            delimiter_char = None
+            match = None
+            if self.matcher.pattern is not None:
+                match = self.next_delimiter()
+                if match is not None:
+                    #  The first character that completes the delimiter.
+                    if char_ends is None:
+                        delimiter_char = max(i, match[1] - block_base - 1)
+                    else:
+                        delimiter_char = bisect.bisect_left(char_ends, match[1] - block_base, i)
 
-    if not rp.pretty_output:  #  Try to convert it to the output format right away
-        c = e_encode(e_decode(c, file_encoding, file_source), rp.output_encoding, file_source)
+            cut_char = None
+            if self.rp.cut_lines:
+                cut_char = i + self.rp.max_line_length - 1 - self.chars_since_cut
+                if cut_char >= num_chars:
+                    cut_char = None
 
-    return more_chars, c
+            if delimiter_char is None and cut_char is None:
+                self.chars_since_cut += num_chars - i
+                break
+
+            if delimiter_char is not None and (cut_char is None or delimiter_char <= cut_char):
+                self.split_at_delimiter(char_end(delimiter_char), match)
+                self.chars_since_cut += delimiter_char - i + 1
+                i = delimiter_char + 1
+            else:
+                i = cut_char + 1
+
+            #  For cutting long lines into multiple lines
+            if i - 1 == cut_char:
+                self.add_line(self.line_start, char_end(cut_char), self.current_level)
+                self.line_start = char_end(cut_char)
+                self.chars_since_cut = 0
+
+        #  Only keep the part of the stream that can still end up in a line.
+        del self.buf[0:self.line_start - self.base]
+        self.base = self.line_start
+
+    def finish(self):
+        if self.line_start < self.base + len(self.buf):
+            self.add_line(self.line_start, self.base + len(self.buf), self.current_level)
+        #  Add an extra entry so we know how long the entire thing is.
+        self.byte_offsets.append(self.current_byte_offset)
+        return self.rtn, self.byte_offsets, self.indentation_levels
+
+class MappedLines(object):
+    #  The lines of a memory mapped file.  Only the offsets of each line are stored, and
+    #  the bytes of a line are copied out of the mapping when the line is accessed.
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.starts = array.array(OFFSET_TYPECODE)
+        self.ends = array.array(OFFSET_TYPECODE)
+
+    def append(self, start, end):
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def extend(self, start, length, count):
+        #  Appends 'count' lines that are each 'length' bytes long.
+        self.starts.extend(range(start, start + count * length, length))
+        self.ends.extend(range(start + length, start + (count + 1) * length, length))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return self.mapping[self.starts[i]:self.ends[i]]
+
+class MappedLineSplitter(LineSplitter):
+    #  Same as the LineSplitter, but the stream offsets of each line are recorded instead
+    #  of its contents.  Only valid when the stream offsets are also file offsets.
+    def __init__(self, rp, mapping):
+        LineSplitter.__init__(self, rp)
+        self.rtn = MappedLines(mapping)
+
+    def add_line(self, start, end, level):
+        self.rtn.append(start, end)
+        self.indentation_levels.append(level)
+        self.byte_offsets.append(self.current_byte_offset)
+        self.current_byte_offset += end - start
+
+    def add_lines(self, start, length, count, level):
+        self.rtn.extend(start, length, count)
+        self.indentation_levels.extend([level] * count)
+        self.byte_offsets.extend(range(self.current_byte_offset, self.current_byte_offset + count * length, length))
+        self.current_byte_offset += count * length
+
+class CountingLineSplitter(LineSplitter):
+    #  Same as the LineSplitter, but only counts the lines.
+    def __init__(self, rp):
+        LineSplitter.__init__(self, rp)
+        self.num_lines = 0
+
+    def add_line(self, start, end, level):
+        self.num_lines += 1
+        self.current_byte_offset += end - start
+
+    def add_lines(self, start, length, count, level):
+        self.num_lines += count
+        self.current_byte_offset += count * length
+
+class StreamedLineSplitter(LineSplitter):
+    #  Same as the LineSplitter, but the lines that are no longer needed can be dropped.
+    def __init__(self, rp):
+        LineSplitter.__init__(self, rp)
+        self.first_line = 0  #  The line number of self.rtn[0]
+
+    def drop_lines_before(self, n):
+        k = n - self.first_line
+        if k > 0:
+            del self.rtn[0:k]
+            del self.byte_offsets[0:k]
+            del self.indentation_levels[0:k]
+            self.first_line = n
+
+class FileColumn(object):
+    #  One of the lists returned by read_file_as_list, for a StreamedFile or a FixedWidthFile.
+    def __init__(self, source_file, column, length):
+        self.source_file = source_file
+        self.column = column
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.source_file.get(self.column, i)
+
+class StreamedFile(object):
+    #  A file that is read once to count its lines, and then read again a block at a time as its lines are
+    #  needed.  'lines', 'byte_offsets' and 'indentation_levels' can be used in place of the lists returned by
+    #  read_file_as_list, as long as they are accessed in order, since only the last few lines are kept.
+    def __init__(self, infile, rp, file_encoding, file_source, as_binary):
+        global err_source
+        err_source = file_source
+        self.rp = rp
+        self.file_source = file_source
+        self.as_binary = as_binary
+        in_fileobj = open_input_file(infile, rp, file_encoding, as_binary)
+        counter = CountingLineSplitter(rp)
+        try:
+            for data, char_ends in read_file_blocks(in_fileobj, CharacterConverter(file_encoding, rp, file_source, as_binary), rp, file_source, as_binary):
+                counter.feed(data, char_ends)
+        finally:
+            in_fileobj.close()
+        counter.finish()
+        self.num_lines = counter.num_lines
+        self.num_bytes = counter.current_byte_offset
+        self.splitter = StreamedLineSplitter(rp)
+        self.blocks = read_file_blocks(open_input_file(infile, rp, file_encoding, as_binary), CharacterConverter(file_encoding, rp, file_source, as_binary), rp, file_source, as_binary)
+        self.lines = FileColumn(self, "rtn", self.num_lines)
+        self.byte_offsets = FileColumn(self, "byte_offsets", self.num_lines + 1)
+        self.indentation_levels = FileColumn(self, "indentation_levels", self.num_lines)
+
+    def get(self, column, i):
+        if column == "byte_offsets" and i == self.num_lines:
+            return self.num_bytes  #  The extra entry at the end.
+        splitter = self.splitter
+        splitter.drop_lines_before(i - STREAMED_LINES_KEPT)
+        while i - splitter.first_line >= len(splitter.rtn):
+            global err_source
+            err_source = self.file_source
+            count = err_counts[self.file_source]["count"]
+            block = next(self.blocks, None)
+            err_counts[self.file_source]["count"] = count  #  These errors were counted the first time the file was read.
+            if block is None:
+                splitter.finish()
+                break
+            splitter.feed(block[0], block[1])
+        return getattr(splitter, column)[i - splitter.first_line]
+
+def has_fixed_width_lines(rp):
+    #  True if both files are split into lines of exactly max_line_length bytes (except the last one), as in hex mode.
+    return rp.oldfile_as_binary and rp.newfile_as_binary and rp.pretty_output and rp.cut_lines and rp.delimiter_matcher.pattern is None
+
+class FixedWidthFile(object):
+    #  A file of raw bytes split into lines of exactly 'line_length' bytes (the last one can be shorter).  The file
+    #  is memory mapped and the position of each line is computed from its line number, so nothing is kept for each
+    #  line.  'lines', 'byte_offsets' and 'indentation_levels' can be used in place of the lists returned by
+    #  read_file_as_list.  A slice of 'lines' is the bytes of those lines joined together, which is enough to compare them.
+    def __init__(self, infile, rp, line_length):
+        in_fileobj = open_input_file(infile, rp, None, True)
+        try:
+            self.size = os.fstat(in_fileobj.fileno()).st_size
+            self.mapping = b""
+            if self.size > 0:
+                self.mapping = mmap.mmap(in_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            in_fileobj.close()
+        self.line_length = line_length
+        self.num_lines = (self.size + line_length - 1) // line_length
+        self.lines = FileColumn(self, "rtn", self.num_lines)
+        self.byte_offsets = FileColumn(self, "byte_offsets", self.num_lines + 1)
+        self.indentation_levels = FileColumn(self, "indentation_levels", self.num_lines)
+
+    def get(self, column, i):
+        if column == "rtn":
+            if isinstance(i, slice):
+                return self.mapping[i.start * self.line_length:i.stop * self.line_length]
+            return self.mapping[i * self.line_length:(i + 1) * self.line_length]
+        elif column == "byte_offsets":
+            return min(i * self.line_length, self.size)
+        else:
+            return 0
+
+def intern_lines(sequences):
+    #  Replaces every line with a small integer id, shared between all of the sequences, so
+    #  that diff() compares integers instead of comparing long lines byte by byte.
+    ids = {}
+    rtn = []
+    for sequence in sequences:
+        rtn.append([ids.setdefault(line, len(ids)) for line in sequence])
+    return rtn
+
+def get_line_ids(sequences):
+    #  Replaces every line with an integer that is the same for lines that have the same
+    #  contents.  Lines are grouped by their hash, so only lines with the same hash are
+    #  ever compared, and no line is kept around after it has been looked at.
+    id_by_hash = {}
+    more_ids_by_hash = {}  #  For lines with different contents but the same hash.
+    #  Where the first line with each id was seen.
+    first_seen_sequence = array.array("i")
+    first_seen_index = array.array(OFFSET_TYPECODE)
+    rtn = []
+    for k in range(0, len(sequences)):
+        sequence = sequences[k]
+        ids = []
+        for i in range(0, len(sequence)):
+            line = sequence[i]
+            h = hash(line)
+            line_id = id_by_hash.get(h)
+            if line_id is not None:
+                candidates = [line_id] + more_ids_by_hash.get(h, [])
+                line_id = None
+                for candidate in candidates:
+                    if sequences[first_seen_sequence[candidate]][first_seen_index[candidate]] == line:
+                        line_id = candidate
+                        break
+            if line_id is None:
+                line_id = len(first_seen_index)
+                first_seen_sequence.append(k)
+                first_seen_index.append(i)
+                if h in id_by_hash:
+                    more_ids_by_hash.setdefault(h, []).append(line_id)
+                else:
+                    id_by_hash[h] = line_id
+            ids.append(line_id)
+        rtn.append(ids)
+    return rtn
 
 def do_file_open_fail_error(f, e, rp):
     fname = e_decode(as_byte_string(f, rp.output_encoding, "internal"), rp.output_encoding, "internal")
@@ -585,17 +1711,8 @@ def do_file_open_fail_error(f, e, rp):
     output_bytes(e_encode(u"Failed to open file " + fname + u": " + msg + rp.output_newline, rp.output_encoding, "internal"), rp)
     do_graceful_exit(rp, FILE_OPEN_FAIL_ERROR_EXIT_CODE)
 
-def read_file_as_list(infile, rp, file_encoding, file_source, as_binary):
-    indentation_levels = []
-    byte_offsets = []
-    rtn = []
+def open_input_file(infile, rp, file_encoding, as_binary):
     in_fileobj = None
-    current_level = 0
-    current_byte_offset = 0
-
-    global err_source
-    err_source = file_source
-
     if as_binary:
         try:
             in_fileobj = open(infile, "rb")
@@ -606,52 +1723,28 @@ def read_file_as_list(infile, rp, file_encoding, file_source, as_binary):
             in_fileobj = codecs.open(infile, "r", encoding=file_encoding, errors="ignore")
         except Exception as e:
             do_file_open_fail_error(infile, e, rp)
-    line = b''
+    return in_fileobj
+
+def read_file_as_list(infile, rp, file_encoding, file_source, as_binary):
+    global err_source
+    err_source = file_source
+
+    in_fileobj = open_input_file(infile, rp, file_encoding, as_binary)
+    splitter = LineSplitter(rp)
+    converter = CharacterConverter(file_encoding, rp, file_source, as_binary)
     try:
-        num_reads = 1
-        more_chars, c = read_char(in_fileobj, file_encoding, rp, file_source, as_binary)
-        #  Note u"".encode("utf-16") == b"\xff\xfe", so be careful on loop termination.
-        while more_chars:
-            line = line + c
-            for d in rp.delimiters:
-                position = line.find(d["delimiter"])
-                if position != -1:
-                    if position > 0:  #  Avoid adding empty lines
-                        rtn.append(line[0:position])
-                        byte_offsets.append(current_byte_offset)
-                        current_byte_offset += len(bytearray(line[0:position]))
-                        indentation_levels.append(current_level)
-                    level_before = current_level
-                    current_level += d["level_adjust"]
-                    if current_level < 0:
-                        current_level = 0
-                    if rp.include_delimiters:
-                        rtn.append(line[position:]) #  Only if you want to include delimiters.
-                        indentation_levels.append(min(current_level, level_before))
-                        byte_offsets.append(current_byte_offset)
-                        current_byte_offset += len(bytearray(line[position:]))
-                    line = b''
-            #  For cutting long lines into multiple lines
-            if rp.cut_lines:
-                if num_reads == rp.max_line_length:
-                    num_reads = 0
-                    rtn.append(line)
-                    indentation_levels.append(current_level)
-                    byte_offsets.append(current_byte_offset)
-                    current_byte_offset += len(bytearray(line))
-                    line = b''
-            more_chars, c = read_char(in_fileobj, file_encoding, rp, file_source, as_binary)
-            num_reads += 1
-        if len(line) > 0:
-            rtn.append(line)
-            indentation_levels.append(current_level)
-            byte_offsets.append(current_byte_offset)
-            current_byte_offset += len(bytearray(line))
+        if rp.use_mmap and as_binary and rp.pretty_output and os.fstat(in_fileobj.fileno()).st_size > 0:
+            #  The bytes of the file are used as is, so lines can be left in the mapping.
+            mapping = mmap.mmap(in_fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            splitter = MappedLineSplitter(rp, mapping)
+            in_fileobj.close()
+            in_fileobj = mapping
+        for data, char_ends in read_file_blocks(in_fileobj, converter, rp, file_source, as_binary):
+            splitter.feed(data, char_ends)
     finally:
-        in_fileobj.close()
-        #  Add an extra entry so we know how long the entire thing is.
-        byte_offsets.append(current_byte_offset)
-    return rtn, byte_offsets, indentation_levels
+        if not isinstance(splitter, MappedLineSplitter):
+            in_fileobj.close()
+    return splitter.finish()
 
 
 def get_terminal_width(rp, unix_terminal_interface, windows_terminal_interface):
@@ -689,8 +1782,41 @@ def validate_delimiters(delimiters, rp):
                     do_graceful_exit(rp, COMMON_PREFIX_ERROR_EXIT_CODE)
         
 
+class OutputSink(object):
+    #  Collects everything that is output, so that it can be written out in one go instead of
+    #  making a system call for every piece of every row.
+    def __init__(self, rp):
+        self.rp = rp
+        self.parts = []
+        self.size = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+
+    def end_row(self):
+        #  Rows are only written out together once enough of them have piled up.
+        if self.size >= self.rp.output_buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.parts) == 0:
+            return
+        data = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        if self.rp.outfile_f is not None:
+            #  Write to file instead of standard out.
+            self.rp.outfile_f.write(data)
+        else:
+            while len(data) > 0:
+                data = data[os.write(sys.stdout.fileno(), data):]
+
 class RunParameters(object):
     def __init__(self, args):
+        self.output_sink = OutputSink(self)
+        self.output_buffer_size = OUTPUT_BUFFER_SIZE
+        self.outfile_f = None
         self.one_indent = u"  "
         self.input_newline = u"\r\n" if is_probably_on_windows() else u"\n"
         self.output_newline = self.input_newline  #  Default to platform.  Will be everwitten later.
@@ -798,6 +1924,7 @@ class RunParameters(object):
                 self.delimiters.append({"delimiter": ed, "level_adjust": -1})
 
         validate_delimiters(self.delimiters, self)
+        self.delimiter_matcher = DelimiterMatcher(self.delimiters)
 
         if args.cols is not None:
             self.terminal_width = args.cols
@@ -857,6 +1984,67 @@ class RunParameters(object):
         if args.enable_mark is not None and args.enable_mark == True:
             self.enable_mark = True
 
+        self.use_mmap = False
+        if args.mmap is not None and args.mmap == True:
+            self.use_mmap = True
+
+        self.algorithm = "myers"
+        if args.algorithm is not None:
+            self.algorithm = args.algorithm
+
+        self.fast = False
+        if args.fast is not None and args.fast == True:
+            self.fast = True
+
+        self.discard_confusing_lines = False
+        if args.discard_confusing_lines is not None and args.discard_confusing_lines == True:
+            self.discard_confusing_lines = True
+
+        self.bit_parallel_width = DEFAULT_BIT_PARALLEL_WIDTH
+        if args.bit_parallel_width is not None:
+            self.bit_parallel_width = args.bit_parallel_width
+            if self.bit_parallel_width < 0:
+                do_bit_parallel_width_error(self)
+
+        self.max_cost = None
+        if args.max_cost is not None:
+            self.max_cost = args.max_cost
+            if not (self.max_cost > 0):
+                do_max_cost_error(self)
+
+        self.jobs = 1
+        if args.jobs is not None:
+            self.jobs = args.jobs
+            if not (self.jobs > 0):
+                do_jobs_error(self)
+
+        self.brief = False
+        if args.brief is not None and args.brief == True:
+            self.brief = True
+
+        self.stat = False
+        if args.stat is not None and args.stat == True:
+            self.stat = True
+
+        self.distance = False
+        if args.distance is not None and args.distance == True:
+            self.distance = True
+
+        self.aligned = False
+        if args.aligned is not None and args.aligned == True:
+            self.aligned = True
+
+        if args.output_buffer_size is not None:
+            self.output_buffer_size = args.output_buffer_size
+            if not (self.output_buffer_size >= 0):
+                do_output_buffer_size_error(self)
+
+        self.max_edits = None
+        if args.max_edits is not None:
+            self.max_edits = args.max_edits
+            if not (self.max_edits >= 0):
+                do_max_edits_error(self)
+
         #  Default print method comes from things we detect in terminal.
         self.use_ansi = False
         if self.unix_terminal_interface is not None:
@@ -890,7 +2078,9 @@ class RunParameters(object):
             self.use_windows_terminal_colours = False
             self.use_ansi = False
 
+        self.verbose = False
         if args.verbose is not None and args.verbose == True:
+            self.verbose = True
             if self.windows_terminal_interface:
                 self.windows_terminal_interface.output_test()
                 output_bytes(e_encode(self.windows_terminal_interface.as_unicode(), self.output_encoding, "internal"), self)
@@ -913,6 +2103,19 @@ class RunParameters(object):
             output_bytes(e_encode(u"parameters_encoding: " + py23_str(self.parameters_encoding, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
             output_bytes(e_encode(u"show_byte_offsets: " + py23_str(self.show_byte_offsets, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
             output_bytes(e_encode(u"enable_mark: " + py23_str(self.enable_mark, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"use_mmap: " + py23_str(self.use_mmap, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"algorithm: " + py23_str(self.algorithm, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"fast: " + py23_str(self.fast, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"max_cost: " + py23_str(self.max_cost, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"bit_parallel_width: " + py23_str(self.bit_parallel_width, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"jobs: " + py23_str(self.jobs, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"max_edits: " + py23_str(self.max_edits, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"brief: " + py23_str(self.brief, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"stat: " + py23_str(self.stat, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"distance: " + py23_str(self.distance, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"aligned: " + py23_str(self.aligned, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"output_buffer_size: " + py23_str(self.output_buffer_size, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
+            output_bytes(e_encode(u"discard_confusing_lines: " + py23_str(self.discard_confusing_lines, self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
             output_bytes(e_encode(u"Total number of delimiters (includes push and pop): " + py23_str(str(len(self.delimiters)), self.output_encoding, "internal") + self.output_newline, self.output_encoding, "internal"), self)
             for d in self.delimiters:
                 output_bytes(e_encode(u"    Level Adjust: " + py23_str(d["level_adjust"], self.output_encoding, "internal") + u" ", self.output_encoding, "internal"), self)
@@ -955,39 +2158,101 @@ class SideBySideViewLines(object):
         self.deletion = deletion
         self.change = change
 
-class ColouredCharacter(object):
-    def __init__(self, character_bytes, colours):
-        #  A character is a list of integers that make up the bytes of the character.
-        assert(isinstance(character_bytes, list))
-        for i in character_bytes:
-            assert(isinstance(i, int))
-        self.character_bytes = character_bytes
+#  Shared colour lists for the spans of a ColouredLine.
+NO_COLOURS = ()
+INSERTION_COLOURS = (INSERTION_COLOUR,)
+DELETION_COLOURS = (DELETION_COLOUR,)
+CHANGE_COLOURS = (CHANGE_COLOUR,)
+CORRECT_COLOURS = (CORRECT_COLOUR,)
+INCORRECT_COLOURS = (INCORRECT_COLOUR,)
+
+class ColourSpan(object):
+    #  The characters from 'start' up to 'end' of a ColouredLine are shown with 'colours'.
+    __slots__ = ("start", "end", "colours")
+
+    def __init__(self, start, end, colours):
+        self.start = start
+        self.end = end
         self.colours = colours
 
+class ColouredLine(object):
+    #  Text that is ready to be shown.  'data' holds the bytes of all of the characters, 'char_ends' is the
+    #  offset into 'data' where each character ends (None when every byte is a character by itself, and
+    #  characters can be zero bytes long), and 'spans' are non-empty ColourSpans that cover all of the
+    #  characters in order.  Lines are never modified once they are made.
+    __slots__ = ("data", "char_ends", "spans")
+
+    def __init__(self, data, char_ends, spans):
+        self.data = data
+        self.char_ends = char_ends
+        self.spans = spans
+
+    def __len__(self):
+        return len(self.data) if self.char_ends is None else len(self.char_ends)
+
+    def __add__(self, other):
+        return join_coloured_lines([self, other])
+
+    def char_start(self, i):
+        if self.char_ends is None:
+            return i
+        return 0 if i == 0 else self.char_ends[i - 1]
+
+    def char_end(self, i):
+        return i + 1 if self.char_ends is None else self.char_ends[i]
+
+    def character(self, i):
+        return self.data[self.char_start(i):self.char_end(i)]
+
+def make_coloured_line(characters, colours):
+    #  Makes a line in one colour out of a list of encoded characters.
+    char_ends = []
+    end = 0
+    for c in characters:
+        end += len(c)
+        char_ends.append(end)
+    return ColouredLine(b"".join(characters), char_ends, [ColourSpan(0, len(char_ends), colours)] if len(char_ends) > 0 else [])
+
+def join_coloured_lines(lines):
+    data = b"".join([line.data for line in lines])
+    char_ends = None
+    if not all([line.char_ends is None for line in lines]):
+        char_ends = []
+        byte_offset = 0
+        for line in lines:
+            if line.char_ends is None:
+                char_ends.extend(range(byte_offset + 1, byte_offset + len(line.data) + 1))
+            else:
+                char_ends.extend([byte_offset + e for e in line.char_ends])
+            byte_offset += len(line.data)
+    spans = []
+    char_offset = 0
+    for line in lines:
+        for span in line.spans:
+            if len(spans) > 0 and spans[-1].colours == span.colours and spans[-1].end == char_offset + span.start:
+                spans[-1] = ColourSpan(spans[-1].start, char_offset + span.end, span.colours)
+            else:
+                spans.append(ColourSpan(char_offset + span.start, char_offset + span.end, span.colours))
+        char_offset += len(line)
+    return ColouredLine(data, char_ends, spans)
+
+EMPTY_COLOURED_LINE = ColouredLine(b"", None, [])
+
 def coloured_text(line, colours, rp, err):
     #  Expects line to be made up of individual characters (not bytes)
-    result = []
     grouped = group_unicode_characters(line)
-    for c in encode_unicode_characters(grouped, rp.output_encoding, err):
-        i_bytes = [py23_ord(b) for b in c]
-        result.append(ColouredCharacter(i_bytes, colours))
-
-    return result
+    return make_coloured_line(encode_unicode_characters(grouped, rp.output_encoding, err), colours)
 
 
 def apply_character_colours(character_bytes, bg_colours, rp, err):
-    #  Iterate over all characters, and return a list of coloured characters
-    result = []
+    #  Make a line of the given colour out of the bytes of a line from one of the files.
     if rp.pretty_output:
-        for b in list(character_bytes):
-            result.append(ColouredCharacter([py23_ord(b)], bg_colours))
+        #  Every byte is a character.
+        return ColouredLine(character_bytes, None, [ColourSpan(0, len(character_bytes), bg_colours)] if len(character_bytes) > 0 else [])
     else:
         decoded = e_decode(character_bytes, rp.output_encoding, err)
         grouped = group_unicode_characters(decoded)
-        for c in encode_unicode_characters(grouped, rp.output_encoding, err):
-            result.append(ColouredCharacter([py23_ord(b) for b in c], bg_colours))
-
-    return result
+        return make_coloured_line(encode_unicode_characters(grouped, rp.output_encoding, err), bg_colours)
 
 def get_recursive_diff_list(chrs, rp, err):
     #  Each line is a byte array that contains one character
@@ -998,16 +2263,53 @@ def get_recursive_diff_list(chrs, rp, err):
         grouped = group_unicode_characters(decoded)
         return encode_unicode_characters(grouped, rp.output_encoding, err)
 
+class IntraLineDiffCache(object):
+    #  A least recently used cache of the highlighted ColouredLines of changed line pairs, keyed by the pair of
+    #  lines.  The encoding errors that were counted while diffing the pair are counted again on every hit.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry  #  Now the most recently used.
+        self.hits += 1
+        old_line, new_line, errors, num_bytes = entry
+        for k in errors:
+            err_counts[k]["count"] += errors[k]
+        return old_line, new_line
+
+    def put(self, key, old_line, new_line, errors):
+        num_bytes = len(key[0]) + len(key[1]) + len(old_line.data) + len(new_line.data)
+        if num_bytes > self.max_bytes:
+            return
+        self.entries[key] = (old_line, new_line, errors, num_bytes)
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_bytes:
+            k, entry = self.entries.popitem(last=False)
+            self.num_bytes -= entry[3]
+
 class DiffViewIterator(object):
     def __init__(self, diff_state, rp, is_recursive):
         self.rp = rp
         self.is_recursive = is_recursive
         self.diff_state = diff_state
-        self.current_edit_script_index = 0
+        #  The edit script can be a generator that is still computing the diff, so hunks are only taken from it as needed.
+        self.edits = iter(diff_state.edit_script)
+        self.current_edit = next(self.edits, None)
+        self.current_edit_offset = 0  #  How many edits of the current hunk have been shown.
+        self.last_edit = None
         self.current_view_line = 0
         self.current_old_file_line = 0
         self.current_new_file_line = 0
         self.current_header_line = 0
+        self.change_cache = None if is_recursive else IntraLineDiffCache(INTRA_LINE_DIFF_CACHE_BYTES)
 
     def dot_lines(self, old_start, new_start, old_end, new_end):
         enc = self.rp.output_encoding
@@ -1026,8 +2328,8 @@ class DiffViewIterator(object):
         old_skip_message = u"--- " + things + u" " + o1 + u"-" + o2 + u" match---"
         new_skip_message = u"--- " + things + u" " + n1 + u"-" + n2 + u" match---"
         rtn = SideBySideViewLines(
-            coloured_text(old_skip_message, [], self.rp, "internal"),
-            coloured_text(new_skip_message, [], self.rp, "internal"),
+            coloured_text(old_skip_message, NO_COLOURS, self.rp, "internal"),
+            coloured_text(new_skip_message, NO_COLOURS, self.rp, "internal"),
             None,
             None,
             True,
@@ -1038,14 +2340,14 @@ class DiffViewIterator(object):
         return rtn
 
     def no_change_lines(self):
-        indent_old = []
-        indent_new = []
+        indent_old = EMPTY_COLOURED_LINE
+        indent_new = EMPTY_COLOURED_LINE
         if not self.is_recursive:
-            indent_old = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], [], self.rp, "internal")
-            indent_new = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], [], self.rp, "internal")
+            indent_old = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], NO_COLOURS, self.rp, "internal")
+            indent_new = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], NO_COLOURS, self.rp, "internal")
         rtn = SideBySideViewLines(
-            indent_old + apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], [], self.rp, "oldfile"),
-            indent_new + apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], [], self.rp, "newfile"),
+            indent_old + apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], NO_COLOURS, self.rp, "oldfile"),
+            indent_new + apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], NO_COLOURS, self.rp, "newfile"),
             self.current_old_file_line,
             self.current_new_file_line,
             True,
@@ -1058,13 +2360,13 @@ class DiffViewIterator(object):
         return rtn
 
     def insertion_lines(self):
-        indent_new = []
+        indent_new = EMPTY_COLOURED_LINE
         if not self.is_recursive:
-            indent_new = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], [], self.rp, "internal")
+            indent_new = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], NO_COLOURS, self.rp, "internal")
 
         rtn = SideBySideViewLines(
             None,
-            indent_new + apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], [INSERTION_COLOUR], self.rp, "newfile"),
+            indent_new + apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], INSERTION_COLOURS, self.rp, "newfile"),
             None,
             self.current_new_file_line,
             False,
@@ -1073,16 +2375,16 @@ class DiffViewIterator(object):
             False
         )
         self.current_new_file_line = self.current_new_file_line + 1
-        self.current_edit_script_index = self.current_edit_script_index + 1
+        self.next_edit()
         return rtn
 
     def deletion_lines(self):
-        indent_old = []
+        indent_old = EMPTY_COLOURED_LINE
         if not self.is_recursive:
-            indent_old = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], [], self.rp, "internal")
+            indent_old = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], NO_COLOURS, self.rp, "internal")
 
         rtn = SideBySideViewLines(
-            indent_old + apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], [DELETION_COLOUR], self.rp, "oldfile"),
+            indent_old + apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], DELETION_COLOURS, self.rp, "oldfile"),
             None,
             self.current_old_file_line,
             None,
@@ -1092,14 +2394,14 @@ class DiffViewIterator(object):
             False
         )
         self.current_old_file_line = self.current_old_file_line + 1
-        self.current_edit_script_index = self.current_edit_script_index + 1
+        self.next_edit()
         return rtn
 
     def change_lines(self):
         if self.is_recursive:
             rtn = SideBySideViewLines(
-                apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], [CHANGE_COLOUR], self.rp, "oldfile"),
-                apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], [CHANGE_COLOUR], self.rp, "newfile"),
+                apply_character_colours(self.diff_state.old_sequence[self.current_old_file_line], CHANGE_COLOURS, self.rp, "oldfile"),
+                apply_character_colours(self.diff_state.new_sequence[self.current_new_file_line], CHANGE_COLOURS, self.rp, "newfile"),
                 self.current_old_file_line,
                 self.current_new_file_line,
                 False,
@@ -1108,27 +2410,20 @@ class DiffViewIterator(object):
                 True
             )
         else:
-            #  Recursively diff the two lines to get a better view
-            old_sequence = get_recursive_diff_list(self.diff_state.old_sequence[self.current_old_file_line], self.rp, "oldfile")
-            new_sequence = get_recursive_diff_list(self.diff_state.new_sequence[self.current_new_file_line], self.rp, "newfile")
-            edit_script = simplify_edit_script(diff(old_sequence, new_sequence))
-            diff_state = DiffState(self.rp, old_sequence, new_sequence, [], [], [], [], edit_script)
-            
-            diff_view_iterator = DiffViewIterator(diff_state, self.rp, True)
-            
-            old_line_result = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], [], self.rp, "internal")
-            new_line_result = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], [], self.rp, "internal")
-            #  Re-construct the two lines with their new highlighted colours
-            while True:
-                side_by_side = diff_view_iterator.get_next_side_by_side_lines(self.rp, diff_state)
-                if side_by_side is None:
-                    break
+            old_line = self.diff_state.old_sequence[self.current_old_file_line]
+            new_line = self.diff_state.new_sequence[self.current_new_file_line]
+            cached = self.change_cache.get((old_line, new_line))
+            if cached is None:
+                errors_before = get_error_counts()
+                old_characters, new_characters = self.diff_changed_line_pair(old_line, new_line)
+                errors_after = get_error_counts()
+                errors = dict([(k, errors_after[k] - errors_before[k]) for k in errors_after])
+                self.change_cache.put((old_line, new_line), old_characters, new_characters, errors)
+            else:
+                old_characters, new_characters = cached
 
-                if not side_by_side.old_line is None:
-                    old_line_result += side_by_side.old_line
-                if not side_by_side.new_line is None:
-                    new_line_result += side_by_side.new_line
-            
+            old_line_result = coloured_text(self.rp.one_indent * self.diff_state.indents_old[self.current_old_file_line], NO_COLOURS, self.rp, "internal") + old_characters
+            new_line_result = coloured_text(self.rp.one_indent * self.diff_state.indents_new[self.current_new_file_line], NO_COLOURS, self.rp, "internal") + new_characters
             rtn = SideBySideViewLines(
                 old_line_result,
                 new_line_result,
@@ -1141,9 +2436,41 @@ class DiffViewIterator(object):
             )
         self.current_old_file_line = self.current_old_file_line + 1
         self.current_new_file_line = self.current_new_file_line + 1
-        self.current_edit_script_index = self.current_edit_script_index + 1
+        self.next_edit()
         return rtn
 
+    def diff_changed_line_pair(self, old_line, new_line):
+        #  Recursively diff the two lines to get a better view
+        old_sequence = get_recursive_diff_list(old_line, self.rp, "oldfile")
+        new_sequence = get_recursive_diff_list(new_line, self.rp, "newfile")
+        edit_script = simplify_edit_script(diff_characters(old_sequence, new_sequence, get_max_cost(self.rp, len(old_sequence) + len(new_sequence)), self.rp.bit_parallel_width))
+        diff_state = DiffState(self.rp, old_sequence, new_sequence, [], [], [], [], edit_script)
+
+        diff_view_iterator = DiffViewIterator(diff_state, self.rp, True)
+
+        old_line_parts = []
+        new_line_parts = []
+        #  Re-construct the two lines with their new highlighted colours
+        while True:
+            side_by_side = diff_view_iterator.get_next_side_by_side_lines(self.rp, diff_state)
+            if side_by_side is None:
+                break
+
+            if not side_by_side.old_line is None:
+                old_line_parts.append(side_by_side.old_line)
+            if not side_by_side.new_line is None:
+                new_line_parts.append(side_by_side.new_line)
+        return join_coloured_lines(old_line_parts), join_coloured_lines(new_line_parts)
+
+    def next_edit(self):
+        self.current_edit_offset = self.current_edit_offset + 1
+        if self.current_edit_offset == self.current_edit.length():
+            if not self.is_recursive:
+                self.rp.output_sink.flush()  #  Finding the next edit can take a while, so show what is ready so far.
+            self.last_edit = self.current_edit
+            self.current_edit = next(self.edits, None)
+            self.current_edit_offset = 0
+
     def get_next_side_by_side_lines(self, rp, diff_state):
         if not self.is_recursive and rp.enable_header and self.current_header_line == 0:
             str_new = e_decode(as_byte_string(rp.newfile_message, rp.parameters_encoding, "parameters"), rp.parameters_encoding, "parameters")
@@ -1156,8 +2483,8 @@ class DiffViewIterator(object):
                 str_old = u" " + str_old
             self.current_header_line += 1
             return SideBySideViewLines(
-                coloured_text(str_old, [], self.rp, "internal"),
-                coloured_text(str_new, [], self.rp, "internal"),
+                coloured_text(str_old, NO_COLOURS, self.rp, "internal"),
+                coloured_text(str_new, NO_COLOURS, self.rp, "internal"),
                 None,
                 None,
                 None,
@@ -1168,8 +2495,8 @@ class DiffViewIterator(object):
         elif not self.is_recursive and rp.enable_header and self.current_header_line == 1:
             self.current_header_line += 1
             return SideBySideViewLines(
-                coloured_text(u"", [], self.rp, "internal"),
-                coloured_text(u"", [], self.rp, "internal"),
+                coloured_text(u"", NO_COLOURS, self.rp, "internal"),
+                coloured_text(u"", NO_COLOURS, self.rp, "internal"),
                 None,
                 None,
                 None,
@@ -1178,18 +2505,18 @@ class DiffViewIterator(object):
                 False
             )
         else:
-            num_edits = len(diff_state.edit_script)
+            last_edit = self.last_edit
             #  If we're finished with all the edits, and both files
             if (
-                self.current_edit_script_index == num_edits and
+                self.current_edit is None and
                 self.current_old_file_line >= len(self.diff_state.old_sequence) and
                 self.current_new_file_line >= len(self.diff_state.new_sequence)
             ):
                 return None
 
             #  If we're currently after all the edits
-            if self.current_edit_script_index == num_edits:
-                if self.rp.infinite_context or self.is_recursive or (num_edits > 0 and self.current_old_file_line <= (diff_state.edit_script[num_edits-1]["position_old"] + self.rp.lines_context)):
+            if self.current_edit is None:
+                if self.rp.infinite_context or self.is_recursive or (last_edit is not None and self.current_old_file_line <= (last_edit.position_old(last_edit.length() - 1) + self.rp.lines_context)):
                     return self.no_change_lines()
                 else:
                     #  Finish early.
@@ -1199,26 +2526,26 @@ class DiffViewIterator(object):
                     self.current_new_file_line = len(self.diff_state.new_sequence)
                     return self.dot_lines(old_b, new_b, self.current_old_file_line - 1, self.current_new_file_line -1)
 
-            current_edit = diff_state.edit_script[self.current_edit_script_index]
+            current_edit = self.current_edit
+            current_position_old = current_edit.position_old(self.current_edit_offset)
 
             #  If we're before the next edit starts
-            if self.current_old_file_line < current_edit["position_old"]:
-                last_i = self.current_edit_script_index - 1
+            if self.current_old_file_line < current_position_old:
                 if (
                     self.rp.infinite_context or
                     self.is_recursive or
                     #  If we're just before the next edit
-                    (self.current_old_file_line + self.rp.lines_context >= current_edit["position_old"]) or
+                    (self.current_old_file_line + self.rp.lines_context >= current_position_old) or
                     #  If we're just after the last edit
                     (
-                        last_i >= 0 and
-                        self.current_old_file_line <= diff_state.edit_script[last_i]["position_old"] + self.rp.lines_context 
+                        last_edit is not None and
+                        self.current_old_file_line <= last_edit.position_old(last_edit.length() - 1) + self.rp.lines_context 
                     )
                 ):
                     return self.no_change_lines()
                 else:
                     #  Just skip to just before the next edit
-                    skip_num = current_edit["position_old"] - self.current_old_file_line - self.rp.lines_context
+                    skip_num = current_position_old - self.current_old_file_line - self.rp.lines_context
                     old_b = self.current_old_file_line
                     new_b = self.current_new_file_line
                     self.current_old_file_line += skip_num
@@ -1226,12 +2553,12 @@ class DiffViewIterator(object):
                     return self.dot_lines(old_b, new_b, self.current_old_file_line - 1, self.current_new_file_line - 1)
 
             #  If we're currently processing one of the edits
-            if current_edit["position_old"] == self.current_old_file_line:
-                if current_edit["operation"] == "delete":
+            if current_position_old == self.current_old_file_line:
+                if current_edit.operation == "delete":
                     return self.deletion_lines()
-                elif current_edit["operation"] == "insert":
+                elif current_edit.operation == "insert":
                     return self.insertion_lines()
-                elif current_edit["operation"] == "change":
+                elif current_edit.operation == "change":
                     return self.change_lines()
 
             raise #  Should never get here.
@@ -1261,41 +2588,54 @@ def render_line_number(side_by_side, num, current_offset_into_line, rp, diff_sta
 
     rtn = []
     for c in text:
-        rtn += coloured_text(
+        rtn.append(coloured_text(
             c, 
-            [] if (c == u" " or c == u".") else get_bg_colours(
+            NO_COLOURS if (c == u" " or c == u".") else get_bg_colours(
                 side_by_side.insertion, side_by_side.deletion, side_by_side.change
             ),
             rp,
             "internal"
-        )
-    return rtn
-
-def calculate_character_width(c, rp):
-    b, print_length = make_character_presentable(c.character_bytes, rp)
-    return print_length
-
-def count_chars_that_fit(text, current_offset_into_line, rp, diff_state):
-    #  Since characters can have a variable width, we need to check how many will fit on one line
+        ))
+    return join_coloured_lines(rtn)
+
+def calculate_cumulative_widths(text, rp):
+    #  Returns a list where entry i is the width of the first i characters of the line once they are presented,
+    #  so the width of any run of characters can be found without looking at the characters again.
+    widths = [0]
+    if text is None:
+        return widths
+    cache = get_presentation_cache(rp)
+    data = text.data
+    char_ends = text.char_ends if text.char_ends is not None else range(1, len(data) + 1)
     total_character_width = 0
-    #  Current index of the character in the line
-    current_pos = current_offset_into_line
-    while (text is not None) and (current_pos < len(text)):
-        c = text[current_pos]
-        assert(isinstance(c, ColouredCharacter))
-        char_width = calculate_character_width(c, rp)
-        if (total_character_width + char_width) < diff_state.line_data_width:
-            total_character_width += char_width
-            current_pos += 1
+    char_start = 0
+    for char_end in char_ends:
+        c = data[char_start:char_end]
+        char_start = char_end
+        r = cache.get(c)
+        if r is not None and r[2] == 0:
+            total_character_width += r[1]
         else:
-            #  Return the number of characters that could fit into one line, and flag if there might be more chrs
-            return current_pos - current_offset_into_line, True
-    #  Return num of chrs, and that there are no more characters.
-    return current_pos - current_offset_into_line, False
-
-def determine_max_chrs_to_show(old_line, new_line, offset_into_old_line, offset_into_new_line, rp, diff_state):
-    num_chars_that_fit_old, old_has_more = count_chars_that_fit(old_line, offset_into_old_line, rp, diff_state)
-    num_chars_that_fit_new, new_has_more = count_chars_that_fit(new_line, offset_into_new_line, rp, diff_state)
+            total_character_width += make_character_presentable(c, rp)[1]
+        widths.append(total_character_width)
+    return widths
+
+def count_chars_that_fit(text, widths, current_offset_into_line, diff_state):
+    #  Since characters can have a variable width, we need to check how many will fit on one line
+    if (text is None) or (current_offset_into_line >= len(text)):
+        return 0, False
+    #  The first character that would make the row at least as wide as the space for it.
+    limit = widths[current_offset_into_line] + diff_state.line_data_width
+    end = bisect.bisect_left(widths, limit, current_offset_into_line + 1)
+    if end == len(widths):
+        #  Return num of chrs, and that there are no more characters.
+        return len(text) - current_offset_into_line, False
+    #  Return the number of characters that could fit into one line, and flag if there might be more chrs
+    return end - 1 - current_offset_into_line, True
+
+def determine_max_chrs_to_show(old_line, new_line, old_widths, new_widths, offset_into_old_line, offset_into_new_line, diff_state):
+    num_chars_that_fit_old, old_has_more = count_chars_that_fit(old_line, old_widths, offset_into_old_line, diff_state)
+    num_chars_that_fit_new, new_has_more = count_chars_that_fit(new_line, new_widths, offset_into_new_line, diff_state)
     if old_has_more and new_has_more:
         #  Pick the min, because other one would overflow its side
         return min(num_chars_that_fit_old, num_chars_that_fit_new), False
@@ -1326,38 +2666,85 @@ def get_replacement_char(c):
         return u" "
     return None
 
+presentable_byte_tables = {}  #  For each output encoding, see get_presentable_byte_table
+
+def get_presentable_byte_table(rp):
+    #  Returns (single, escaped) where single[b] is what make_character_presentable returns for a character made
+    #  of just the byte string b, and escaped[b] is the escaped form of b.  Hex mode shows lots of these.
+    table = presentable_byte_tables.get(rp.output_encoding)
+    if table is None:
+        single = {}
+        escaped = {}
+        for byte in range(0, 256):
+            b = int_array_as_byte_string([byte])
+            escaped[b] = b"\\x" + as_byte_string(format(byte, '02X'), rp.output_encoding, "internal")
+            if byte == ord('\t'):
+                single[b] = (b"    ", 4)
+            elif byte > 31 and byte < 127:
+                #  Standard ascii character
+                single[b] = (b, 1)
+            else:
+                single[b] = (escaped[b], len(escaped[b]))
+        table = (single, escaped)
+        presentable_byte_tables[rp.output_encoding] = table
+    return table
+
+presentation_caches = {}  #  For each output encoding and output style, see get_presentation_cache
+
+def get_presentation_cache(rp):
+    #  Returns a dict that maps each encoded character to (bytes, width, internal_errors) where the bytes and
+    #  the width are what make_character_presentable returns for it, and internal_errors is the number of
+    #  errors that working them out caused.  Every character on a line is looked up at least twice, once
+    #  to find out how many fit on a row and once to print them.
+    key = (rp.output_encoding, rp.pretty_output)
+    cache = presentation_caches.get(key)
+    if cache is None:
+        cache = {}
+        if rp.pretty_output:
+            single, escaped = get_presentable_byte_table(rp)
+            for b in single:
+                cache[b] = single[b] + (0,)
+        presentation_caches[key] = cache
+    return cache
+
 def make_character_presentable(c, rp):
+    #  Returns the bytes to print for the encoded character c, and how many columns they take up.
+    global err_counts
+    cache = get_presentation_cache(rp)
+    r = cache.get(c)
+    if r is None:
+        errors_before = err_counts["internal"]["count"]
+        b, print_length = present_character(c, rp)
+        r = (b, print_length, err_counts["internal"]["count"] - errors_before)
+        cache[c] = r
+    elif r[2] != 0:
+        err_counts["internal"]["count"] += r[2]
+    return r[0], r[1]
+
+def present_character(c, rp):
     if len(c) == 0:
         return c, 0  #  The result of an ignored failed decode from an invalid character.
 
-    #  A character at this point should be a list of integers.
-    for b in c:
-        assert(type(b) == int)
     if rp.pretty_output:
-        if len(c) == 1 and ((c[0] > 31 and c[0] < 127) or c[0] == ord('\t')):
-            #  Standard ascii character
-            if c[0] == ord('\t'):
-                return [ord(u" "),ord(u" "),ord(u" "),ord(u" ")], 4
-            else:
-                return [c[0]], 1
+        single, escaped = get_presentable_byte_table(rp)
+        if len(c) == 1:
+            return single[c]
         else:
-            #  Extended ASCII characer or multi-byte character.
-            rtn = []
-            for byte in c:
-                rtn += [py23_ord(b) for b in (b"\\x" + as_byte_string(format(byte, '02X'), rp.output_encoding, "internal"))]
+            #  Multi-byte character.
+            rtn = b"".join([escaped[c[k:k + 1]] for k in range(0, len(c))])
             return rtn, len(rtn)
     else:
         #  This is not precise at all, but it is the best that can be done
-        char_as_unicode = e_decode(int_array_as_byte_string(c), rp.output_encoding, "internal")
+        char_as_unicode = e_decode(c, rp.output_encoding, "internal")
         if len(char_as_unicode) == 0:
-            return [], 0  #  Happens sometimes due to decode failure on invalid characters. 
+            return b"", 0  #  Happens sometimes due to decode failure on invalid characters. 
         east_asian_width = get_east_asian_width(char_as_unicode)
         replacement_chars = get_replacement_char(char_as_unicode)
         if replacement_chars is None:
             return c, east_asian_width
         else:
             ls = [get_east_asian_width(c) for c in replacement_chars]
-            return [py23_ord(b) for b in as_byte_string(replacement_chars, rp.output_encoding, "internal")], sum(ls)
+            return as_byte_string(replacement_chars, rp.output_encoding, "internal"), sum(ls)
 
 def get_east_asian_width(unicode_str):
     r = unicodedata.east_asian_width(unicode_str)
@@ -1376,77 +2763,120 @@ def get_east_asian_width(unicode_str):
     else:
         return 1
 
-def make_characters_presentable(chrs, rp):
+def make_characters_presentable(line, start, end, rp):
+    #  Returns a ColouredLine of what is printed for the characters from 'start' up to 'end' of the line, and its width.
+    parts = []
+    spans = []
     total_print_length = 0
-    for i in range(0, len(chrs)):
-        chrs[i].character_bytes, char_print_len = make_character_presentable(chrs[i].character_bytes, rp)
-        total_print_length += char_print_len
-        for b in chrs[i].character_bytes:
-            assert(type(b) == int)
-    return chrs, total_print_length
-
+    cache = get_presentation_cache(rp)
+    for span in line.spans:
+        if span.end <= start:
+            continue
+        if span.start >= end:
+            break
+        span_start = max(span.start, start)
+        span_end = min(span.end, end)
+        if span_start < span_end:
+            for i in range(span_start, span_end):
+                c = line.character(i)
+                r = cache.get(c)
+                if r is not None and r[2] == 0:
+                    b = r[0]
+                    char_print_len = r[1]
+                else:
+                    b, char_print_len = make_character_presentable(c, rp)
+                parts.append(b)
+                total_print_length += char_print_len
+            spans.append(ColourSpan(span_start - start, span_end - start, span.colours))
+    rtn = make_coloured_line(parts, NO_COLOURS)
+    rtn.spans = spans
+    return rtn, total_print_length
 
-def print_coloured_character(c, rp):
-    character_bytes = bytearray(c.character_bytes)
 
+def print_coloured_line(line, rp):
     win = rp.windows_terminal_interface
     unix = rp.unix_terminal_interface
 
-    sys.stdout.flush()
-    if rp.use_windows_terminal_colours:
-        try:
-            win.set_terminal_colours(c.colours)
-        except:
-            pass
-
-    if rp.use_ansi:
-        unix.set_terminal_colours(c.colours)
-
-    output_bytes(character_bytes, rp)
-    sys.stdout.flush() #  Required on Windows for terminal colours to appear.
-
-    if rp.use_ansi:
-        unix.reset_terminal_colours()
-
-    if rp.use_windows_terminal_colours:
-        try:
-            win.reset_terminal_colours()
-        except:
-            pass
+    for span in line.spans:
+        if rp.use_windows_terminal_colours:
+            sys.stdout.flush()
+            try:
+                win.set_terminal_colours(span.colours)
+            except:
+                pass
 
+        if rp.use_ansi:
+            output_bytes(unix.switch_colours_sequence(span.colours) + line.data[line.char_start(span.start):line.char_end(span.end - 1)], rp)
+        else:
+            output_bytes(line.data[line.char_start(span.start):line.char_end(span.end - 1)], rp)
 
-def print_coloured_characters(chrs, rp):
-    for c in chrs:
-        print_coloured_character(c, rp)
+        if rp.use_windows_terminal_colours:
+            sys.stdout.flush() #  Required on Windows for terminal colours to appear.
+            try:
+                win.reset_terminal_colours()
+            except:
+                pass
 
 def render_line_text(text, current_offset_into_line, max_chars_to_show, rp, diff_state):
-    line = coloured_text(u"--", [], rp, "internal")
+    line = coloured_text(u"--", NO_COLOURS, rp, "internal")
     if text is not None:
         line = text
     if current_offset_into_line > len(line):  #  Is there nothing more to process?
-        return coloured_text(u" " * diff_state.line_data_width, [], rp, "internal")
+        return coloured_text(u" " * diff_state.line_data_width, NO_COLOURS, rp, "internal")
 
-    #  The rest of the line remaining (if it is a line that must be chopped up)
-    chars_to_show = line[current_offset_into_line:(current_offset_into_line + max_chars_to_show)]
-    #  This is the number of characters that are presented in the view (for example after hex encoding non-printables)
-    characters_view, characters_view_length = make_characters_presentable(chars_to_show, rp)
+    #  The rest of the line remaining (if it is a line that must be chopped up), as it is presented in the
+    #  view (for example after hex encoding non-printables), and its width.
+    characters_view, characters_view_length = make_characters_presentable(line, current_offset_into_line, current_offset_into_line + max_chars_to_show, rp)
     #  Add spaces onto the end for alignment:
     if characters_view_length < diff_state.line_data_width:
         num_padding_spaces = diff_state.line_data_width - characters_view_length
-        characters_view = characters_view + coloured_text(u" " * num_padding_spaces, [], rp, "internal")
+        characters_view = characters_view + coloured_text(u" " * num_padding_spaces, NO_COLOURS, rp, "internal")
 
     return characters_view
 
 def get_bg_colours(insertion, deletion, change):
     if insertion:
-        return [INSERTION_COLOUR]
+        return INSERTION_COLOURS
     if deletion:
-        return [DELETION_COLOUR]
+        return DELETION_COLOURS
     if change:
-       return [CHANGE_COLOUR]
-    return []
+       return CHANGE_COLOURS
+    return NO_COLOURS
 
 
+def do_max_cost_error(rp):
+    msg = u"The specified max cost is " + e_decode(as_byte_string(str(rp.max_cost), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must be greater than 0! Exiting..." + rp.output_newline
+    output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, INVALID_MAX_COST_ERROR_EXIT_CODE)
+
+def do_jobs_error(rp):
+    msg = u"The specified number of jobs is " + e_decode(as_byte_string(str(rp.jobs), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must be greater than 0! Exiting..." + rp.output_newline
+    output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, INVALID_JOBS_ERROR_EXIT_CODE)
+
+def do_output_buffer_size_error(rp):
+    msg = u"The specified output buffer size is " + e_decode(as_byte_string(str(rp.output_buffer_size), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must not be negative! Exiting..." + rp.output_newline
+    output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, INVALID_OUTPUT_BUFFER_SIZE_ERROR_EXIT_CODE)
+
+def do_bit_parallel_width_error(rp):
+    msg = u"The specified bit parallel width is " + e_decode(as_byte_string(str(rp.bit_parallel_width), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must not be negative! Exiting..." + rp.output_newline
+    output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, INVALID_BIT_PARALLEL_WIDTH_ERROR_EXIT_CODE)
+
+def do_max_edits_error(rp):
+    msg = u"The specified max edits is " + e_decode(as_byte_string(str(rp.max_edits), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must not be negative! Exiting..." + rp.output_newline
+    output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, INVALID_MAX_EDITS_ERROR_EXIT_CODE)
+
+def get_max_cost(rp, size):
+    #  The cost limit to use when diffing sequences with 'size' items in total, or None to always find the smallest edit script.
+    if rp.max_cost is not None:
+        return rp.max_cost
+    if rp.fast:
+        return max(FAST_MIN_MAX_COST, int(math.sqrt(size)))
+    return None
+
 def do_max_line_length_error(rp):
     msg = u"The specified max line length is " + e_decode(as_byte_string(str(rp.max_line_length), rp.output_encoding, "internal"), rp.output_encoding, "internal") + u" but it must be greater than 0! Exiting..." + rp.output_newline
     output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
@@ -1458,12 +2888,8 @@ def do_terminal_width_error(rp):
     do_graceful_exit(rp, TERMINAL_WIDTH_ERROR_EXIT_CODE)
 
 def output_bytes(s, rp):
-    #  Expects already encoded bytes to be passed
-    if rp.outfile_f is not None:
-        #  Write to file instead of standard out.
-        rp.outfile_f.write(s)
-    else:
-        os.write(sys.stdout.fileno(), s)
+    #  Expects already encoded bytes to be passed.  They are written out when rp.output_sink is flushed.
+    rp.output_sink.write(s)
 
 def do_error_count_warnings(rp):
     global err_counts
@@ -1475,6 +2901,40 @@ def do_error_count_warnings(rp):
             msg = u"WARNING: " + count + u" encoding errors ignored while processing " + src + u" to " + dst + rp.output_newline
             output_bytes(e_encode(msg, rp.output_encoding, "internal"), rp)
 
+def files_have_same_bytes(oldfile, newfile):
+    try:
+        if os.path.getsize(oldfile) != os.path.getsize(newfile):
+            return False
+        with open(oldfile, "rb") as old_f:
+            with open(newfile, "rb") as new_f:
+                while True:
+                    old_block = old_f.read(READ_BLOCK_SIZE)
+                    if old_block != new_f.read(READ_BLOCK_SIZE):
+                        return False
+                    if len(old_block) == 0:
+                        return True
+    except (IOError, OSError):
+        return False  #  Let reading the files report the problem.
+
+def sequences_equal(old_sequence, new_sequence):
+    if len(old_sequence) != len(new_sequence):
+        return False
+    for i in range(0, len(old_sequence)):
+        if old_sequence[i] != new_sequence[i]:
+            return False
+    return True
+
+def do_files_differ_message(rp):
+    oldfile = e_decode(as_byte_string(rp.oldfile, rp.output_encoding, "internal"), rp.output_encoding, "internal")
+    newfile = e_decode(as_byte_string(rp.newfile, rp.output_encoding, "internal"), rp.output_encoding, "internal")
+    output_bytes(e_encode(u"Files " + oldfile + u" and " + newfile + u" differ" + rp.output_newline, rp.output_encoding, "internal"), rp)
+    do_graceful_exit(rp, FILES_DIFFER_EXIT_CODE)
+
+def print_count(name, count, rp):
+    if not is_unicode_instance(count):
+        count = py23_str(count, rp.output_encoding, "internal")
+    output_bytes(e_encode(name + u": " + count + rp.output_newline, rp.output_encoding, "internal"), rp)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("oldfile", help="File name of old version.", type=str)
@@ -1508,16 +2968,90 @@ def main():
     parser.add_argument("-e", help="Set the encoding of oldfile, newfile, output, and parameters at the same time", type=str)
     parser.add_argument("-m", help="Equivalent to explicitly adding flags of the form: --push-delimiters PUSH_DELIMS --pop-delimiters POP_DELIMS --include-delimiters.  For -m json, -m css, or -m js,  PUSH_DELIMS, POP_DELIMS = \"(\" \"{\" \"[\", \")\" \"}\" \"]\".  For -m html: \"(\" \"{\" \"[\" \"<\", \")\" \"}\" \"]\" \">\".", type=str)
     parser.add_argument("-x", help="Display all bytes of the file in a pseudo-hex editor like format.  Requires an integer argument to know how many bytes to display on each line.  All output will be in standard ASCII.  Equivalent to setting adding the following flags: --delimiters --show-byte-offsets --max-line.  If you also explicitly set the output encoding will turn off hex encoding of characters.", type=int)
+    parser.add_argument("--mmap", help="Memory map the input files and only keep the position of each line in memory instead of a copy of it.  This is useful for very large files.  Only applies to files that are read as raw bytes (no --oldfile-encoding or --newfile-encoding) when no --output-encoding is given, otherwise the file is read normally.", action='store_true')
+    parser.add_argument("--algorithm", help="The algorithm used to match up the lines of the two files.  'myers' (the default) finds the smallest possible set of changes.  'patience' and 'histogram' first match up lines that are unique (or rare) in both files and only search for the smallest set of changes between them.  They are faster on large files and often line up changes to source code in a more readable way.", type=str, choices=["myers", "patience", "histogram"])
+    parser.add_argument("--fast", help="Don't insist on finding the smallest possible set of changes.  Once finding it gets too expensive, the files are split at the furthest point matched so far, like Unix diff does without --minimal.  This makes the diff much faster on files with many differences.  The cost limit is the square root of the number of lines (or characters), but at least " + str(FAST_MIN_MAX_COST) + ".", action='store_true')
+    parser.add_argument("--max-cost", help="Same as --fast, but explicitly sets the cost limit.  Expects an integer greater than 0.  Smaller values are faster, but the diff is less likely to be the smallest one.", type=int)
+    parser.add_argument("--discard-confusing-lines", help="Before matching up lines, leave out lines that don't appear in the other file at all, and very common lines (like blank lines) that are surrounded by such lines, the same way Unix diff does.  The lines that were left out are shown as inserted or deleted.  This makes large files with many unmatched lines much faster to diff.  Works with any --algorithm.", action='store_true')
+    parser.add_argument("--bit-parallel-width", help="Expects an integer that is 0 or more.  When a pair of changed lines is diffed character by character, a faster bit-parallel search is used if the shorter line (not counting the parts at the beginning and end that are the same) has at most this many characters.  Use 0 to turn off the bit-parallel search.  Defaults to " + str(DEFAULT_BIT_PARALLEL_WIDTH) + ".", type=int)
+    parser.add_argument("--jobs", help="Expects an integer greater than 0.  Diff independent parts of large files in this many worker processes at the same time.  The result is the same as without it.  Only has an effect on Python 3.  Defaults to 1.", type=int)
+    parser.add_argument("--max-edits", help="Expects an integer that is 0 or more.  If the lines that differ between the two files (or between two lines matched up by --algorithm patience or histogram) need more than this many inserted and deleted lines, stop searching and show all of them as replaced.  This puts a limit on how long a diff of two very different files can take.", type=int)
+    parser.add_argument("--brief", help="Don't show the differences.  Only check whether there are any, and if there are, print a message and exit with status " + str(FILES_DIFFER_EXIT_CODE) + ".  Files with exactly the same bytes are not even read.", action='store_true')
+    parser.add_argument("--stat", help="Don't show the differences.  Only print how many lines were changed, inserted and deleted.", action='store_true')
+    parser.add_argument("--distance", help="Don't show the differences.  Only print the number of inserted and deleted lines in the smallest set of differences (a changed line counts as one of each).  This is computed in linear memory, without finding the differences themselves.  With --max-edits, stops counting after that many.", action='store_true')
+    parser.add_argument("--aligned", help="Match up each line with the line at the same position in the other file, instead of searching for inserted and deleted lines.  Only changed lines are shown (and the extra lines at the end of the longer file as inserted or deleted), which is what you want for files of the same size that were patched in place, like firmware or disk images viewed with -x.  This takes linear time, and with -x and no encodings the files are memory mapped and nothing is kept for each line.  --algorithm and the options that limit its search have no effect, and --distance counts the inserted and deleted lines of these edits.", action='store_true')
+    parser.add_argument("--output-buffer-size", help="Expects an integer that is 0 or more.  Output is collected and written out at the end of a row once at least this many bytes are waiting, and whenever the diff is still searching for the next difference.  Use 0 to write out every row as soon as it is complete.  Defaults to " + str(OUTPUT_BUFFER_SIZE) + ".", type=int)
     parser.add_argument("--version", action='version', version="This is the very first version, so the version number is kind of arbitrary...  Let's call it version 0.01.")
 
     rp = RunParameters(parser.parse_args())
     global GLOBAL_RUN_PARAMS
     GLOBAL_RUN_PARAMS = rp
 
-    old_sequence, byte_offsets_old, indents_old = read_file_as_list(rp.oldfile, rp, rp.oldfile_encoding, "oldfile", rp.oldfile_as_binary)
-    new_sequence, byte_offsets_new, indents_new = read_file_as_list(rp.newfile, rp, rp.newfile_encoding, "newfile", rp.oldfile_as_binary)
+    #  Files with the same bytes are read into the same lines, so they don't need to be diffed.
+    identical = rp.oldfile_encoding == rp.newfile_encoding and rp.oldfile_as_binary == rp.newfile_as_binary and files_have_same_bytes(rp.oldfile, rp.newfile)
+
+    if rp.brief:
+        if not identical:
+            old_sequence = read_file_as_list(rp.oldfile, rp, rp.oldfile_encoding, "oldfile", rp.oldfile_as_binary)[0]
+            new_sequence = read_file_as_list(rp.newfile, rp, rp.newfile_encoding, "newfile", rp.oldfile_as_binary)[0]
+            if not sequences_equal(old_sequence, new_sequence):
+                do_error_count_warnings(rp)
+                do_files_differ_message(rp)
+        do_error_count_warnings(rp)
+        return
+
+    if identical:
+        #  Show the old file on both sides as it is read, without keeping it in memory.
+        errors_before = err_counts["oldfile"]["count"]
+        streamed_file = StreamedFile(rp.oldfile, rp, rp.oldfile_encoding, "oldfile", rp.oldfile_as_binary)
+        err_counts["newfile"]["count"] += err_counts["oldfile"]["count"] - errors_before  #  Reading the new file would have found the same errors.
+        old_sequence = new_sequence = streamed_file.lines
+        byte_offsets_old = byte_offsets_new = streamed_file.byte_offsets
+        indents_old = indents_new = streamed_file.indentation_levels
+        edit_script = []
+    elif rp.aligned and has_fixed_width_lines(rp):
+        #  Lines are found from their line number, so the files don't need to be read ahead of time.
+        old_file = FixedWidthFile(rp.oldfile, rp, rp.max_line_length)
+        new_file = FixedWidthFile(rp.newfile, rp, rp.max_line_length)
+        old_sequence, byte_offsets_old, indents_old = old_file.lines, old_file.byte_offsets, old_file.indentation_levels
+        new_sequence, byte_offsets_new, indents_new = new_file.lines, new_file.byte_offsets, new_file.indentation_levels
+        edit_script = diff_aligned(old_sequence, new_sequence)
+    else:
+        old_sequence, byte_offsets_old, indents_old = read_file_as_list(rp.oldfile, rp, rp.oldfile_encoding, "oldfile", rp.oldfile_as_binary)
+        new_sequence, byte_offsets_new, indents_new = read_file_as_list(rp.newfile, rp, rp.newfile_encoding, "newfile", rp.oldfile_as_binary)
+
+        #  Diff line ids instead of the lines themselves.  The edit script refers to lines by position, so the view still uses the lines.
+        if rp.use_mmap:
+            old_ids, new_ids = get_line_ids([old_sequence, new_sequence])  #  Avoids keeping a copy of every distinct line.
+        else:
+            old_ids, new_ids = intern_lines([old_sequence, new_sequence])
+        if rp.aligned:
+            edit_script = diff_aligned(old_ids, new_ids)
+        elif rp.distance and not rp.stat:
+            edit_script = None  #  The distance is found by diff_length, without finding the edit script.
+        else:
+            edit_script = simplify_edit_script(diff_with_algorithm(old_ids, new_ids, rp.algorithm, get_max_cost(rp, len(old_ids) + len(new_ids)), rp.discard_confusing_lines, rp.jobs, rp.max_edits))
+
+    if rp.distance or rp.stat:
+        #  Only print numbers, without building anything needed to show the lines.
+        distance = 0
+        counts = {"change": 0, "insert": 0, "delete": 0}
+        if edit_script is not None:
+            for hunk in edit_script:
+                distance += hunk.old_length + hunk.new_length
+                counts[hunk.operation] += hunk.length()
+        if rp.distance:
+            if not rp.aligned and not identical:
+                i, I, j, J = trimmed_window(old_ids, new_ids)
+                distance = diff_length(old_ids, new_ids, i, I, j, J, rp.max_edits)
+            print_count(u"distance", distance if distance is not None else u"more than " + py23_str(rp.max_edits, rp.output_encoding, "internal"), rp)
+        if rp.stat:
+            print_count(u"changed", counts["change"], rp)
+            print_count(u"inserted", counts["insert"], rp)
+            print_count(u"deleted", counts["delete"], rp)
+        do_error_count_warnings(rp)
+        return
 
-    edit_script = simplify_edit_script(diff(old_sequence, new_sequence))
     diff_state = DiffState(rp, old_sequence, new_sequence, byte_offsets_old, byte_offsets_new, indents_old, indents_new, edit_script)
     
     if diff_state.line_data_width < 1:
@@ -1525,10 +3059,10 @@ def main():
     
     diff_view_iterator = DiffViewIterator(diff_state, rp, False)
 
-    rendered_separator = coloured_text(diff_state.separator, [], rp, "internal")
-    rendered_incorrect_symbol = coloured_text(diff_state.incorrect_symbol, [INCORRECT_COLOUR], rp, "internal")
-    rendered_correct_symbol = coloured_text(diff_state.correct_symbol, [CORRECT_COLOUR], rp, "internal")
-    rendered_newline = coloured_text(rp.output_newline, [], rp, "internal")
+    rendered_separator = coloured_text(diff_state.separator, NO_COLOURS, rp, "internal")
+    rendered_incorrect_symbol = coloured_text(diff_state.incorrect_symbol, INCORRECT_COLOURS, rp, "internal")
+    rendered_correct_symbol = coloured_text(diff_state.correct_symbol, CORRECT_COLOURS, rp, "internal")
+    rendered_newline = coloured_text(rp.output_newline, NO_COLOURS, rp, "internal")
     
     #  Print out all of the lines in the two files
     while True:
@@ -1543,10 +3077,12 @@ def main():
     
         offset_into_old_line = 0
         offset_into_new_line = 0
+        old_widths = calculate_cumulative_widths(side_by_side.old_line, rp)
+        new_widths = calculate_cumulative_widths(side_by_side.new_line, rp)
     
         #  Wrap the current pair of lines from the file as many times as necessary to show it in the terminal.
         while True:
-            max_chars_to_show, finished_line = determine_max_chrs_to_show(side_by_side.old_line, side_by_side.new_line, offset_into_old_line, offset_into_new_line, rp, diff_state)
+            max_chars_to_show, finished_line = determine_max_chrs_to_show(side_by_side.old_line, side_by_side.new_line, old_widths, new_widths, offset_into_old_line, offset_into_new_line, diff_state)
 
             rendered_line_old = render_line_text(side_by_side.old_line, offset_into_old_line, max_chars_to_show, rp, diff_state)
             rendered_line_new = render_line_text(side_by_side.new_line, offset_into_new_line, max_chars_to_show, rp, diff_state)
@@ -1558,24 +3094,25 @@ def main():
     
             if rp.enable_mark:
                 if side_by_side.match:
-                    print_coloured_characters(rendered_incorrect_symbol, rp)
+                    print_coloured_line(rendered_incorrect_symbol, rp)
                 else:
-                    print_coloured_characters(rendered_correct_symbol, rp)
+                    print_coloured_line(rendered_correct_symbol, rp)
 
-            print_coloured_characters(rendered_separator, rp)
+            print_coloured_line(rendered_separator, rp)
     
-            print_coloured_characters(rendered_number_new, rp)
+            print_coloured_line(rendered_number_new, rp)
     
-            print_coloured_characters(rendered_line_new, rp)
+            print_coloured_line(rendered_line_new, rp)
     
-            print_coloured_characters(rendered_separator, rp)
-            print_coloured_characters(rendered_number_old, rp)
+            print_coloured_line(rendered_separator, rp)
+            print_coloured_line(rendered_number_old, rp)
     
-            print_coloured_characters(rendered_line_old, rp)
+            print_coloured_line(rendered_line_old, rp)
     
-            print_coloured_characters(rendered_separator, rp)
+            print_coloured_line(rendered_separator, rp)
     
-            print_coloured_characters(rendered_newline, rp)
+            print_coloured_line(rendered_newline, rp)
+            rp.output_sink.end_row()
 
             #  If both the new and old have completely consumed the available characters, move onto the next line
             if finished_line:
@@ -1585,6 +3122,10 @@ def main():
                 if max_chars_to_show == 0:
                     do_terminal_width_error(rp)
 
+    if rp.verbose:
+        cache = diff_view_iterator.change_cache
+        output_bytes(e_encode(u"intra_line_diff_cache: " + py23_str(cache.hits, rp.output_encoding, "internal") + u" hits, " + py23_str(cache.misses, rp.output_encoding, "internal") + u" misses, " + py23_str(cache.num_bytes, rp.output_encoding, "internal") + u" bytes" + rp.output_newline, rp.output_encoding, "internal"), rp)
+
     do_error_count_warnings(rp)
     
 if __name__ == "__main__":
@@ -246,6 +246,39 @@ def get_show_byte_offsets_param():
 def get_outfile_param():
     return ["--outfile", "tmp_outfile_test" if is_probably_on_windows() else "/tmp/tmp_outfile_test"]
 
+def get_mmap_param():
+    return ["--mmap"]
+
+def get_algorithm_param():
+    return ["--algorithm", random.choice(["myers", "patience", "histogram"])]
+
+def get_fast_param():
+    return ["--fast"]
+
+def get_max_cost_param():
+    return ["--max-cost", str(random.randint(-1,20))]
+
+def get_discard_confusing_lines_param():
+    return ["--discard-confusing-lines"]
+
+def get_bit_parallel_width_param():
+    return ["--bit-parallel-width", str(random.randint(-1,200))]
+
+def get_jobs_param():
+    return ["--jobs", str(random.randint(0,4))]
+
+def get_max_edits_param():
+    return ["--max-edits", str(random.randint(-1,20))]
+
+def get_summary_params():
+    return [["--brief"], ["--stat"], ["--distance"], ["--stat", "--distance"]][random.randint(0,3)]
+
+def get_aligned_param():
+    return ["--aligned"]
+
+def get_output_buffer_size_param():
+    return ["--output-buffer-size", str(random.randint(-1,4096))]
+
 def get_random_params():
     params = []
     #  Two mandatory input files.
@@ -321,6 +354,39 @@ def get_random_params():
     if random.randint(0, 1) == 0:
         params += get_outfile_param()
 
+    if random.randint(0, 1) == 0:
+        params += get_mmap_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_algorithm_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_fast_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_max_cost_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_discard_confusing_lines_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_bit_parallel_width_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_jobs_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_max_edits_param()
+
+    if random.randint(0, 3) == 0:
+        params += get_summary_params()
+
+    if random.randint(0, 3) == 0:
+        params += get_aligned_param()
+
+    if random.randint(0, 1) == 0:
+        params += get_output_buffer_size_param()
+
     return params
 
 def get_special_case_params():
@@ -341,7 +407,19 @@ def get_special_case_params():
         [u"tests/utf_8/fancy1", u"tests/utf_8/fancy2", u"--delimiters", u"日本国", u"--include-delimiters", u"--parameters-encoding", u"\"utf-8\"", u"--output-encoding", u"\"utf-8\"", u"--newfile-encoding", u"\"utf-8\"", u"--oldfile-encoding", u"\"utf-8\""],
         [u"tests/utf_8/fancy1", u"tests/utf_8/fancy2", u"--delimiters", u"\"\\u65e5\\u672c\\u56fd\"", u"--include-delimiters", u"--parameters-encoding", u"\"utf-8\"", u"--output-encoding", u"\"utf-8\"", u"--newfile-encoding", u"\"utf-8\"", u"--oldfile-encoding", u"\"utf-8\""],
         [u"tests/utf_8/this-is-encoded-in-utf-8", u"tests/utf_16/this-is-encoded-in-utf-16", u"--output-encoding", u"\"utf-8\"", u"--newfile-encoding", u"\"utf-16\"", u"--oldfile-encoding", u"\"utf-8\"", u"--enable-mark"],
-        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"-m", u"html"]
+        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"-m", u"html"],
+        [u"tests/ascii/ex1", u"tests/ascii/ex2", u"--mmap"],
+        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"--algorithm", u"patience"],
+        [u"tests/ascii/a.json", u"tests/ascii/b.json", u"--algorithm", u"histogram"],
+        [u"tests/ascii/a.json", u"tests/ascii/b.json", u"--algorithm", u"patience", u"--jobs", u"4"],
+        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"--max-edits", u"3"],
+        [u"tests/ascii/ex1", u"tests/ascii/ex1", u"--brief"],
+        [u"tests/ascii/ex1", u"tests/ascii/ex2", u"--brief"],
+        [u"tests/ascii/a.json", u"tests/ascii/b.json", u"--stat", u"--distance"],
+        [u"tests/ascii/a.html", u"tests/ascii/a.html", u"--infinite-context", u"--show-byte-offsets"],
+        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"--aligned", u"-x", u"16"],
+        [u"tests/ascii/a.html", u"tests/ascii/b.html", u"--output-buffer-size", u"0", u"--outfile", u"/dev/null"],
+        [u"tests/binary/binary-502-bytes", u"tests/binary/binary-899-bytes", u"--output-encoding", u"iso2022_jp", u"--pop-delimiters", u"WV", u"-m", u"html", u"--cols", u"50", u"--max-line-length", u"57", u"--enable-ansi", u"--infinite-context", u"--enable-mark"]
     ]
     return special_cases[random.randint(0, len(special_cases)-1)]
 
@@ -379,6 +457,29 @@ def get_visual_test_params(enc):
     current_visual_param_number += 1
     return rtn;
 
+#  Pairs of parameters that must give exactly the same output.
+REFERENCE_OUTPUT_CHECKS = [
+    #  Every line in histogram-chain-1 that is also in histogram-chain-2 appears 65 times, which is more
+    #  than the histogram diff ever uses as an anchor, so it has to find the same edit script as myers.
+    ([u"tests/ascii/histogram-chain-1", u"tests/ascii/histogram-chain-2", u"--cols", u"80", u"--infinite-context", u"--algorithm", u"histogram"],
+     [u"tests/ascii/histogram-chain-1", u"tests/ascii/histogram-chain-2", u"--cols", u"80", u"--infinite-context", u"--algorithm", u"myers"])
+]
+
+def check_reference_outputs():
+    for python_exec in PYTHON_EXECS:
+        for (a, b) in REFERENCE_OUTPUT_CHECKS:
+            outputs = []
+            for p in [a, b]:
+                params = [python_exec, RES_DIFF_SCRIPT_LOCATION] + p
+                print(u"Begin reference check.  CMD is : " + (u" ".join(params)))
+                sys.stdout.flush()
+                outputs.append(subprocess.Popen(params, stdout=subprocess.PIPE).communicate()[0])
+            if outputs[0] != outputs[1]:
+                print(u"Reference check failed, the outputs are not the same.")
+                exit()
+    print(u"Pass")
+    sys.stdout.flush()
+
 def get_random_test_params():
     if random.randint(0, 1) == 0:
         return get_random_params()
@@ -393,6 +494,8 @@ if len(sys.argv) > 1:
 
 if visual_mode:
     print(u"Running tests in visual mode.  Expecting a human to watch results to see if they look fine.")
+else:
+    check_reference_outputs()
 
 while True:
     python_exec = PYTHON_EXECS[random.randint(0,len(PYTHON_EXECS)-1)]
@@ -420,7 +523,7 @@ while True:
     if rtn > 0:
         #  Stop and make the error obvious.
         #  If the error is not in the list of known error codes.
-        if not rtn in [100, 101, 102, 103, 104]:
+        if not rtn in [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110]:
             print(u"Saw unexpected return code: " + str(rtn))
             exit()
     print(u"Pass")